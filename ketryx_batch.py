@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Ketryx Template Batch Runner
+
+Non-interactive template generation for many documents through the Message
+Batches API. Each round submits the next turn of every unfinished document
+as one batch, polls until it has ended, then downloads produced files and
+queues follow-up turns. Per-document conversation state is kept in a local
+JSON state file so an interrupted run can be resumed with the same command.
+
+Used through `ketryx_template_agent.py --batch`.
+"""
+
+import json
+import re
+import time
+from pathlib import Path
+from typing import List
+
+import anthropic
+
+from ketryx_template_agent import (
+    AGENT_BETAS,
+    build_initial_message,
+    build_request_params,
+    estimate_cost,
+    fetch_generated_files,
+    promote_output,
+    scan_response,
+    select_newest,
+    serialize_content,
+    upload_file,
+)
+
+
+# Batch requests are billed at half the standard rate
+BATCH_DISCOUNT = 0.5
+MAX_REQUEST_ERRORS = 3
+CUSTOM_ID_PATTERN = re.compile(r"[^a-zA-Z0-9_-]")
+
+
+def _custom_id(index: int, docx_path: str) -> str:
+    stem = CUSTOM_ID_PATTERN.sub("_", Path(docx_path).stem)
+    return f"{index:04d}_{stem}"[:64]
+
+
+class BatchRunner:
+    """Drives template generation for many documents in batch rounds."""
+
+    def __init__(self, client: anthropic.Anthropic, state_path: str, poll_interval: float = 60.0):
+        self.client = client
+        self.state_path = Path(state_path)
+        self.poll_interval = poll_interval
+        self.state = {}
+
+    # -------------------------------------------------------------------------
+    # State
+    # -------------------------------------------------------------------------
+
+    def load_or_init(self, docx_paths: List[str], data_path: str, syntax_path: str,
+                     output_dir: str, model: str, max_iterations: int, cost_limit: float) -> None:
+        if self.state_path.exists():
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+            print(f"Resuming batch run from {self.state_path}")
+        else:
+            self.state = {
+                "model": model,
+                "maxIterations": max_iterations,
+                "costLimit": cost_limit,
+                "dataPath": data_path,
+                "syntaxPath": syntax_path,
+                "dataFileId": None,
+                "syntaxFileId": None,
+                "batchId": None,
+                "round": 0,
+                "documents": {},
+            }
+
+        documents = self.state["documents"]
+        known = {doc["docx"] for doc in documents.values()}
+        for docx_path in docx_paths:
+            if docx_path in known:
+                continue
+            custom_id = _custom_id(len(documents), docx_path)
+            documents[custom_id] = {
+                "docx": docx_path,
+                "outputPath": str(Path(output_dir) / f"{Path(docx_path).stem}_Template.docx"),
+                "runDir": str(Path(output_dir) / "runs" / custom_id),
+                "docxFileId": None,
+                "status": "pending",
+                "messages": [],
+                "containerId": None,
+                "awaitingBatch": None,
+                "iterations": 0,
+                "totalCost": 0.0,
+                "requestErrors": 0,
+                "error": None,
+            }
+        self.save()
+
+    def save(self) -> None:
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        tmp_path.replace(self.state_path)
+
+    # -------------------------------------------------------------------------
+    # Run
+    # -------------------------------------------------------------------------
+
+    def run(self) -> dict:
+        self._upload_files()
+
+        while True:
+            if self.state["batchId"]:
+                self._collect(self.state["batchId"])
+                self.state["batchId"] = None
+                self.save()
+
+            if not self._submit_round():
+                break
+
+        return self.state["documents"]
+
+    def _upload_files(self) -> None:
+        state = self.state
+        if not state["dataFileId"]:
+            state["dataFileId"] = upload_file(self.client, state["dataPath"])
+            self.save()
+        if not state["syntaxFileId"]:
+            state["syntaxFileId"] = upload_file(self.client, state["syntaxPath"])
+            self.save()
+
+        for doc in state["documents"].values():
+            if doc["status"] != "pending":
+                continue
+            doc["docxFileId"] = upload_file(self.client, doc["docx"])
+            doc["messages"] = [build_initial_message(
+                doc["docxFileId"], state["dataFileId"], state["syntaxFileId"], doc["outputPath"]
+            )]
+            doc["status"] = "running"
+            print(f"  Uploaded {doc['docx']} -> {doc['docxFileId']}")
+            self.save()
+
+    def _submit_round(self) -> bool:
+        """Submit the next turn of every running document; False when none are left."""
+        requests = []
+        for custom_id, doc in self.state["documents"].items():
+            if doc["status"] != "running":
+                continue
+            if doc["iterations"] >= self.state["maxIterations"]:
+                self._finish(doc, "failed", "Max iterations")
+                continue
+            if doc["totalCost"] >= self.state["costLimit"]:
+                self._finish(doc, "failed", "Cost limit reached")
+                continue
+            requests.append({
+                "custom_id": custom_id,
+                "params": build_request_params(self.state["model"], doc["messages"], doc["containerId"]),
+            })
+
+        if not requests:
+            self.save()
+            return False
+
+        batch = self.client.beta.messages.batches.create(requests=requests, betas=AGENT_BETAS)
+        for request in requests:
+            self.state["documents"][request["custom_id"]]["awaitingBatch"] = batch.id
+        self.state["batchId"] = batch.id
+        self.state["round"] += 1
+        self.save()
+        print(f"\nRound {self.state['round']}: submitted {len(requests)} requests as {batch.id}")
+        return True
+
+    def _collect(self, batch_id: str) -> None:
+        while True:
+            batch = self.client.beta.messages.batches.retrieve(batch_id, betas=AGENT_BETAS)
+            if batch.processing_status == "ended":
+                break
+            counts = batch.request_counts
+            print(f"  {batch_id}: {counts.processing} processing, {counts.succeeded} succeeded")
+            time.sleep(self.poll_interval)
+
+        for entry in self.client.beta.messages.batches.results(batch_id, betas=AGENT_BETAS):
+            doc = self.state["documents"].get(entry.custom_id)
+            # Results already applied before an interruption are skipped on resume
+            if not doc or doc["status"] != "running" or doc["awaitingBatch"] != batch_id:
+                continue
+            doc["awaitingBatch"] = None
+
+            if entry.result.type == "succeeded":
+                print(f"\n[{entry.custom_id}]")
+                self._process_message(doc, entry.result.message)
+            else:
+                # Errored, canceled or expired requests are resubmitted next round
+                doc["requestErrors"] += 1
+                if doc["requestErrors"] >= MAX_REQUEST_ERRORS:
+                    self._finish(doc, "failed", f"Batch request {entry.result.type}")
+            self.save()
+
+    def _process_message(self, doc: dict, message) -> None:
+        doc["iterations"] += 1
+        usage = message.usage
+        doc["totalCost"] += estimate_cost(self.state["model"], usage.input_tokens, usage.output_tokens) * BATCH_DISCOUNT
+
+        if getattr(message, "container", None):
+            doc["containerId"] = message.container.id
+
+        file_ids, _, _ = scan_response(message.content)
+        newest = select_newest(fetch_generated_files(self.client, file_ids, doc["runDir"]))
+        has_file = newest is not None
+        if has_file:
+            promote_output(newest, doc["outputPath"])
+
+        doc["messages"].append({"role": "assistant", "content": serialize_content(message.content)})
+
+        if message.stop_reason == "end_turn":
+            if has_file:
+                self._finish(doc, "done")
+            else:
+                doc["messages"].append({"role": "user", "content": "Please save the template document now."})
+
+    def _finish(self, doc: dict, status: str, error: str = None) -> None:
+        doc["status"] = status
+        doc["error"] = error
+        # The conversation is no longer needed once a document is settled
+        doc["messages"] = []
+        label = "✓" if status == "done" else "✗"
+        print(f"  {label} {doc['docx']}: {error or doc['outputPath']} (${doc['totalCost']:.3f})")
+
+
+def run_batch(
+    client: anthropic.Anthropic,
+    docx_paths: List[str],
+    data_path: str,
+    syntax_path: str,
+    output_dir: str,
+    state_path: str = None,
+    model: str = "claude-sonnet-4-5-20250929",
+    max_iterations: int = 15,
+    cost_limit: float = 10.0,
+    poll_interval: float = 60.0
+) -> dict:
+    """Generate templates for many documents with the Message Batches API.
+
+    Re-running with the same state file resumes where the last run stopped.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    state_path = state_path or str(Path(output_dir) / "batch_state.json")
+
+    runner = BatchRunner(client, state_path, poll_interval)
+    runner.load_or_init(docx_paths, data_path, syntax_path, output_dir, model, max_iterations, cost_limit)
+    documents = runner.run()
+
+    succeeded = [d for d in documents.values() if d["status"] == "done"]
+    total_cost = sum(d["totalCost"] for d in documents.values())
+    return {
+        "success": len(succeeded) == len(documents),
+        "completed": len(succeeded),
+        "documents": len(documents),
+        "total_cost": total_cost,
+        "error": None if len(succeeded) == len(documents) else f"{len(documents) - len(succeeded)} documents failed",
+    }
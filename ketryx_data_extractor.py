@@ -14,17 +14,31 @@ Environment variables:
 """
 
 import argparse
+import copy
+import heapq
 import json
 import os
+import re
 import sys
+import threading
 import time
-from collections import defaultdict
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from typing import Any, Optional, Union, List, Dict
 from urllib.parse import urljoin
 
 import requests
 
+from ketryx_record_store import UNVERSIONED, RecordStore, record_key
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 
 # =============================================================================
 # Configuration
@@ -34,8 +48,15 @@ DEFAULT_BASE_URL = "https://app.ketryx.com"
 MAX_SAMPLE_VALUES = 5
 MAX_UNIQUE_VALUES = 25
 MAX_SAMPLE_RECORDS = 3
+MAX_SAMPLE_FIELDS = 4
+MAX_SAMPLE_RELATIONS = 3
 MAX_STRING_LENGTH = 100
 REQUEST_DELAY_SECONDS = 0.1
+RECORDS_PAGE_SIZE = 1000
+DEFAULT_WORKERS = 4
+
+# Upper bounds (ms) of the per-endpoint latency histogram buckets
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
 
 # Fields that commonly contain rich text
 RICH_TEXT_FIELD_PATTERNS = {
@@ -44,6 +65,34 @@ RICH_TEXT_FIELD_PATTERNS = {
     "impact", "mitigation", "verification", "acceptance_criteria",
 }
 
+# Field type inference. Whole value columns are joined with a separator that
+# cannot appear in API values and matched with one regex call each.
+COLUMN_SEPARATOR = "\x1f"
+RICH_TEXT_MIN_LENGTH = 500
+ENUM_MIN_VALUES = 10
+ENUM_MAX_DISTINCT_RATIO = 0.5
+
+RICH_TEXT_NAME_RE = re.compile("|".join(
+    re.escape(p.replace("_", " ")) for p in sorted(RICH_TEXT_FIELD_PATTERNS, key=len, reverse=True)
+))
+# An opening tag closed within the same value, or a self-closing <br/>; a lone
+# "<b>" or "<i>" in plain text is not markup
+HTML_TAG_RE = re.compile(
+    r"<(p|ul|ol|li|strong|em|b|i|u|div|span|h[1-6]|table|a)\b[^>\x1f]*>[^\x1f]*?</\1\s*>|<br\s*/>",
+    re.IGNORECASE,
+)
+_NUMBER = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?"
+_ISO_DATE = r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?"
+_BOOLEAN = r"(?i:true|false)"
+NUMBER_COLUMN_RE = re.compile(rf"{_NUMBER}(?:\x1f{_NUMBER})*")
+DATE_COLUMN_RE = re.compile(rf"{_ISO_DATE}(?:\x1f{_ISO_DATE})*")
+BOOLEAN_COLUMN_RE = re.compile(rf"{_BOOLEAN}(?:\x1f{_BOOLEAN})*")
+
+# Exemplar selection. Values longer than this gain no further length credit.
+EXEMPLAR_LENGTH_CAP = 40
+LETTER_RUN_RE = re.compile(r"[^\W\d_]+")
+DIGIT_RUN_RE = re.compile(r"\d+")
+
 # Built-in template variables
 BUILTIN_VARIABLES = {
     "project": {
@@ -146,6 +195,228 @@ class ItemTypeInfo:
         return result
 
 
+# =============================================================================
+# Field type inference
+# =============================================================================
+
+def classify_field(field_name: str, values: list, declared_types: set) -> str:
+    """Infer a field's dataType from its name, declared API types and whole value column.
+    
+    Checks run over the full column at once: typed Python values are counted
+    by type, string values are joined and matched with a single regex per
+    candidate type.
+    """
+    if RICH_TEXT_NAME_RE.search(field_name.lower().replace("_", " ")):
+        return "richText"
+    
+    # Multi-select and other multi-value fields
+    if any(isinstance(v, list) for v in values):
+        return "list"
+    
+    strings = [v for v in values if isinstance(v, str)]
+    column = COLUMN_SEPARATOR.join(strings)
+    if HTML_TAG_RE.search(column) or max(map(len, strings), default=0) > RICH_TEXT_MIN_LENGTH:
+        return "richText"
+    
+    if "number" in declared_types:
+        return "number"
+    if "date" in declared_types or "datetime" in declared_types:
+        return "datetime"
+    if "boolean" in declared_types:
+        return "boolean"
+    
+    # Typed JSON values; bool is counted apart from int because it subclasses it
+    typed = [v for v in values if not isinstance(v, str)]
+    n_bool = sum(1 for v in typed if isinstance(v, bool))
+    n_number = sum(1 for v in typed if isinstance(v, (int, float))) - n_bool
+    
+    if n_bool + n_number == len(typed):
+        if n_bool == len(typed) and (not strings or BOOLEAN_COLUMN_RE.fullmatch(column)):
+            return "boolean"
+        if n_bool == 0 and (not strings or NUMBER_COLUMN_RE.fullmatch(column)):
+            return "number"
+        if not typed and DATE_COLUMN_RE.fullmatch(column):
+            return "datetime"
+    
+    if len(values) >= ENUM_MIN_VALUES:
+        distinct = len(set(map(str, values)))
+        if distinct <= min(MAX_UNIQUE_VALUES, len(values) * ENUM_MAX_DISTINCT_RATIO):
+            return "enum"
+    
+    return "string"
+
+
+# =============================================================================
+# Exemplar selection
+# =============================================================================
+
+def value_text(value) -> str:
+    """String form of a field value; list values are joined."""
+    if isinstance(value, list):
+        return ", ".join(map(str, value))
+    return str(value)
+
+
+def value_shape(value: str) -> str:
+    """Reduce a value to its pattern, e.g. "REQ-12 v2" -> "a-9 a9"."""
+    return LETTER_RUN_RE.sub("a", DIGIT_RUN_RE.sub("9", value))
+
+
+def value_score(value: str, count: int) -> float:
+    """Score how useful a value is for matching document text.
+    
+    Longer values, values mixing letters and digits (IDs, versions) and values
+    that are rare within their field score higher.
+    """
+    score = min(len(value), EXEMPLAR_LENGTH_CAP) / EXEMPLAR_LENGTH_CAP + 1 / count
+    if DIGIT_RUN_RE.search(value) and LETTER_RUN_RE.search(value):
+        score += 0.5
+    return score
+
+
+def select_exemplars(counts: Counter, limit: int) -> list:
+    """Pick the highest-scoring values, one per value shape where possible."""
+    ranked = heapq.nlargest(limit * 4, counts.items(), key=lambda item: value_score(*item))
+    picked, spare, shapes = [], [], set()
+    for value, _ in ranked:
+        shape = value_shape(value)
+        if shape in shapes:
+            spare.append(value)
+            continue
+        shapes.add(shape)
+        picked.append(value)
+        if len(picked) == limit:
+            return picked
+    return picked + spare[:limit - len(picked)]
+
+
+# =============================================================================
+# Metrics
+# =============================================================================
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+class ExtractionMetrics:
+    """Per-phase timings plus per-endpoint request counters for one extraction.
+    
+    With `trace_memory`, each phase also reports the peak Python heap it
+    allocated (tracemalloc), which slows the extraction down noticeably.
+    """
+    
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.phases: List[dict] = []
+        self.endpoints: Dict[str, dict] = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self._records = 0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Measure a block of the extraction as one named phase."""
+        start = time.perf_counter()
+        requests_before = self.requests
+        bytes_before = self.bytes_received
+        with self._lock:
+            self._records = 0
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            peak_heap = None
+            if self.trace_memory:
+                # Peak above what was already allocated when the phase started
+                peak = tracemalloc.get_traced_memory()[1] - traced_before
+                peak_heap = round(peak / (1024 * 1024), 1)
+            with self._lock:
+                records = self._records
+            phase = {
+                "name": name,
+                "wallSeconds": round(wall, 3),
+                "requests": self.requests - requests_before,
+                "bytesReceived": self.bytes_received - bytes_before,
+                "records": records,
+                "recordsPerSecond": round(records / wall, 1) if wall > 0 else None,
+                "peakHeapMB": peak_heap,
+            }
+            with self._lock:
+                self.phases.append(phase)
+    
+    def count_records(self, n: int) -> None:
+        """Add to the number of records handled by the current phase."""
+        with self._lock:
+            self._records += n
+    
+    def record_request(self, method: str, endpoint: str, elapsed: float, nbytes: int, ok: bool) -> None:
+        key = f"{method} {re.sub(r'/KX[A-Z0-9]+', '/{id}', endpoint)}"
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += nbytes
+            stats = self.endpoints.setdefault(key, {
+                "requests": 0,
+                "errors": 0,
+                "bytesReceived": 0,
+                "totalMs": 0.0,
+                "maxMs": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            })
+            stats["requests"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["bytesReceived"] += nbytes
+            stats["totalMs"] += elapsed_ms
+            stats["maxMs"] = max(stats["maxMs"], elapsed_ms)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if elapsed_ms <= bound),
+                          len(LATENCY_BUCKETS_MS))
+            stats["histogram"][bucket] += 1
+    
+    def to_dict(self) -> dict:
+        labels = [f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        endpoints = {}
+        for key, stats in sorted(self.endpoints.items()):
+            endpoints[key] = {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "bytesReceived": stats["bytesReceived"],
+                "meanMs": round(stats["totalMs"] / stats["requests"], 1),
+                "maxMs": round(stats["maxMs"], 1),
+                "histogram": dict(zip(labels, stats["histogram"])),
+            }
+        return {
+            "totalWallSeconds": round(time.perf_counter() - self._started, 3),
+            "requests": self.requests,
+            "bytesReceived": self.bytes_received,
+            "peakRssMB": _peak_rss_mb(),
+            "phases": self.phases,
+            "endpoints": endpoints,
+        }
+    
+    def print_summary(self) -> None:
+        total = sum(p["wallSeconds"] for p in self.phases) or 1.0
+        print("\nPhase timings:", file=sys.stderr)
+        for p in self.phases:
+            share = p["wallSeconds"] / total * 100
+            print(f"  {p['name']:<22} {p['wallSeconds']:>8.2f}s {share:>5.1f}%  "
+                  f"{p['requests']:>5} req  {p['bytesReceived'] / 1024:>9.0f} KB"
+                  + (f"  {p['peakHeapMB']:>7.1f} MB heap" if p["peakHeapMB"] is not None else ""),
+                  file=sys.stderr)
+
+
 # =============================================================================
 # API Client
 # =============================================================================
@@ -153,18 +424,38 @@ class ItemTypeInfo:
 class KetryxAPIClient:
     """Client for Ketryx API."""
     
-    def __init__(self, base_url: str, api_key: str):
+    def __init__(self, base_url: str, api_key: str, metrics: ExtractionMetrics = None):
         self.base_url = base_url.rstrip("/")
+        self.metrics = metrics or ExtractionMetrics()
         self.session = requests.Session()
         self.session.headers.update({
             "Authorization": f"Bearer {api_key}",
             "Accept": "application/json",
         })
+        self._local = threading.local()
+        self._local.session = self.session
+    
+    def with_metrics(self, metrics: ExtractionMetrics) -> "KetryxAPIClient":
+        """Client sharing this one's sessions but recording into separate metrics."""
+        clone = copy.copy(self)
+        clone.metrics = metrics
+        return clone
+    
+    def _thread_session(self) -> requests.Session:
+        """Session for the calling thread; sessions are not shared across threads."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.session.headers)
+            self._local.session = session
+        return session
     
     def _request(self, method: str, endpoint: str, **kwargs) -> Optional[Union[dict, list]]:
         url = urljoin(self.base_url + "/", endpoint.lstrip("/"))
+        start = time.perf_counter()
+        response = None
         try:
-            response = self.session.request(method, url, **kwargs)
+            response = self._thread_session().request(method, url, **kwargs)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
@@ -175,6 +466,14 @@ class KetryxAPIClient:
         except requests.exceptions.RequestException as e:
             print(f"Request failed for {endpoint}: {e}", file=sys.stderr)
             return None
+        finally:
+            self.metrics.record_request(
+                method,
+                endpoint,
+                time.perf_counter() - start,
+                len(response.content) if response is not None else 0,
+                response is not None and response.ok,
+            )
     
     def get_project(self, project_id: str) -> Optional[dict]:
         return self._request("GET", f"/api/v1/projects/{project_id}")
@@ -206,27 +505,37 @@ class KetryxAPIClient:
 class KetryxDataExtractor:
     """Extracts and processes project data into AI-optimized format."""
     
-    def __init__(self, client: KetryxAPIClient, project_id: str, version_id: str = None):
+    def __init__(self, client: KetryxAPIClient, project_id: str, version_id: str = None,
+                 snapshot_versions: str = None, workers: int = DEFAULT_WORKERS):
         self.client = client
         self.project_id = project_id
         self.version_id = version_id
+        self.snapshot_versions = snapshot_versions
+        self.workers = workers
         self.item_types: Dict[str, ItemTypeInfo] = {}
         self.relation_types: Dict[str, RelationTypeInfo] = {}
         self.all_records_by_type: Dict[str, list] = {}
+        self.store = RecordStore()
+        self.snapshot_ids: List[str] = []
+        self.metrics = client.metrics
     
     def extract(self) -> dict:
         """Main extraction workflow."""
+        metrics = self.metrics
         
         # 1. Get project metadata
         print("Fetching project metadata...", file=sys.stderr)
-        project = self.client.get_project(self.project_id)
+        with metrics.phase("projectMetadata"):
+            project = self.client.get_project(self.project_id)
         if not project:
             raise RuntimeError("Failed to fetch project")
         
         # 2. Get versions
         print("Fetching versions...", file=sys.stderr)
-        versions_response = self.client.get_versions(self.project_id)
-        versions = versions_response.get("versions", []) if isinstance(versions_response, dict) else []
+        with metrics.phase("versions"):
+            versions_response = self.client.get_versions(self.project_id)
+            versions = versions_response.get("versions", []) if isinstance(versions_response, dict) else []
+            metrics.count_records(len(versions))
         
         # Auto-select version if not specified
         if not self.version_id and versions:
@@ -237,22 +546,32 @@ class KetryxDataExtractor:
         
         # 3. Discover item types by sampling items
         print("Discovering item types...", file=sys.stderr)
-        self._discover_types_from_items()
+        with metrics.phase("discoverTypes"):
+            self._discover_types_from_items()
         
         # 4. Query records for each discovered type
         print("Fetching records by type...", file=sys.stderr)
-        self._fetch_records_by_type()
+        with metrics.phase("fetchRecords"):
+            self._fetch_records_by_type(versions)
+            metrics.count_records(self.store.storage_stats()["recordReferences"])
         
         # 5. Analyze fields for each type
         print("Analyzing fields...", file=sys.stderr)
-        self._analyze_all_fields()
+        with metrics.phase("analyzeFields"):
+            self._analyze_all_fields()
+            metrics.count_records(sum(len(r) for r in self.all_records_by_type.values()))
         
         # 6. Analyze relations
         print("Analyzing relations...", file=sys.stderr)
-        self._analyze_relations()
+        with metrics.phase("analyzeRelations"):
+            self._analyze_relations()
+            metrics.count_records(sum(len(r) for r in self.all_records_by_type.values()))
         
         # 7. Build output
-        return self._build_output(project, versions, current_version)
+        with metrics.phase("buildOutput"):
+            output = self._build_output(project, versions, current_version)
+            metrics.count_records(len(self.item_types))
+        return output
     
     def _discover_types_from_items(self):
         """Discover item types by fetching records for sample items."""
@@ -261,6 +580,7 @@ class KetryxDataExtractor:
         items = items_response.get("items", []) if isinstance(items_response, dict) else []
         
         print(f"  Sampling {min(len(items), 50)} items to discover types...", file=sys.stderr)
+        self.metrics.count_records(min(len(items), 50))
         
         discovered_types = set()
         
@@ -302,54 +622,151 @@ class KetryxDataExtractor:
                 shortName="",  # Will infer from docId later
             )
     
-    def _fetch_records_by_type(self):
-        """Fetch all records for each discovered type."""
-        types_to_remove = []
+    def _snapshot_version_ids(self, versions: list) -> List[str]:
+        """Versions to fetch, in project version order; always includes the selected one.
         
-        for type_name, type_info in self.item_types.items():
-            time.sleep(REQUEST_DELAY_SECONDS)
-            
-            # Don't pass versionId - query all records for this type
-            records_response = self.client.query_records(
-                self.project_id,
-                type_info.kqlQuery,
-                version_id=None,  # Skip version filtering
-                max_results=1000
-            )
-            
+        `snapshot_versions` is "all", a number N (latest N versions) or a
+        comma-separated list of version IDs or names.
+        """
+        ordered = [v.get("id") for v in versions if v.get("id")]
+        spec = (self.snapshot_versions or "").strip()
+        
+        if spec == "all":
+            wanted = set(ordered)
+        elif spec.isdigit():
+            wanted = set(ordered[-int(spec):]) if int(spec) else set()
+        elif spec:
+            tokens = {t.strip() for t in spec.split(",") if t.strip()}
+            wanted = {v.get("id") for v in versions
+                      if v.get("id") in tokens or (v.get("name") or "").strip() in tokens}
+        else:
+            wanted = set()
+        
+        wanted.add(self.version_id or UNVERSIONED)
+        return [vid for vid in ordered if vid in wanted] + [vid for vid in wanted if vid not in ordered]
+    
+    def _query_type(self, version_id: str, type_name: str) -> tuple:
+        """Records of one type in one version, and whether they came from the unversioned fallback.
+        
+        A single version keeps the first page as before. Multi-version runs
+        page through every record so snapshots can be diffed.
+        """
+        time.sleep(REQUEST_DELAY_SECONDS)
+        kql = self.item_types[type_name].kqlQuery
+        api_version = None if version_id == UNVERSIONED else version_id
+        paginate = len(self.snapshot_ids) > 1
+        
+        records_response = self._query_pages(kql, api_version, paginate)
+        if records_response is None and api_version and api_version == self.version_id:
+            print(f"  {type_name}: versioned query failed, falling back to all records", file=sys.stderr)
+            return self.client.query_records(self.project_id, kql, version_id=None,
+                                             max_results=RECORDS_PAGE_SIZE), True
+        return records_response, False
+    
+    def _query_pages(self, kql: str, version_id: Optional[str], paginate: bool) -> Optional[dict]:
+        response = self.client.query_records(self.project_id, kql, version_id=version_id,
+                                             max_results=RECORDS_PAGE_SIZE)
+        if not response or not paginate:
+            return response
+        records = list(response.get("records", []))
+        total = response.get("total", len(records))
+        while len(records) < total:
+            page = self.client.query_records(self.project_id, kql, version_id=version_id,
+                                             start_at=len(records), max_results=RECORDS_PAGE_SIZE)
+            if not page or not page.get("records"):
+                break
+            records.extend(page["records"])
+        return {"records": records, "total": total}
+    
+    def _fetch_records_by_type(self, versions: list):
+        """Fetch all records for each discovered type in every snapshot version.
+        
+        Queries for all (version, type) pairs run concurrently. Records land in
+        the deduplicated record store; the selected version's records drive
+        the rest of the analysis.
+        """
+        names = {v.get("id"): v.get("name") for v in versions}
+        self.snapshot_ids = self._snapshot_version_ids(versions)
+        selected = self.version_id or UNVERSIONED
+        self.store.selected_version = selected
+        
+        jobs = [(vid, type_name) for vid in self.snapshot_ids for type_name in self.item_types]
+        print(f"  {len(jobs)} queries across {len(self.snapshot_ids)} version(s), "
+              f"{self.workers} workers", file=sys.stderr)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            responses = list(pool.map(lambda job: self._query_type(*job), jobs))
+        
+        totals = {}
+        fetched = set()
+        for (vid, type_name), (records_response, unversioned) in zip(jobs, responses):
+            name = names.get(vid, vid)
             if not records_response:
-                types_to_remove.append(type_name)
+                self.store.mark_incomplete(vid, name, type_name, "failed")
                 continue
-            
-            records = records_response.get("records", [])
+            fetched.add(vid)
+            records = [r for r in records_response.get("records", []) if isinstance(r, dict)]
             total = records_response.get("total", len(records))
-            
-            if records:
-                self.all_records_by_type[type_name] = records
-                type_info.count = total
-                
-                # Infer short name from docId patterns
-                for record in records[:20]:
-                    if isinstance(record, dict):
-                        # Look for docId in fields
-                        for field_obj in record.get("fields", []):
-                            if isinstance(field_obj, dict) and field_obj.get("label") == "ID":
-                                doc_id = field_obj.get("value", "")
-                                if doc_id and "-" in str(doc_id):
-                                    prefix = str(doc_id).split("-")[0]
-                                    if prefix.isalpha() and 1 <= len(prefix) <= 6:
-                                        type_info.shortName = prefix
-                                        break
-                        if type_info.shortName:
-                            break
-                
-                print(f"  {type_name}: {len(records)} records (total: {total})", file=sys.stderr)
+            if unversioned:
+                # Unfiltered records still drive the analysis but are not this version's snapshot
+                self.store.mark_incomplete(vid, name, type_name, "unversioned")
             else:
+                self.store.add_records(vid, name, records)
+                if len(records) < total:
+                    self.store.mark_incomplete(vid, name, type_name, "truncated")
+                # Use the stored copies so records shared across versions exist once
+                records = [self.store.records[record_key(r)] for r in records]
+            if vid == selected and records:
+                self.all_records_by_type[type_name] = records
+                totals[type_name] = total
+        
+        # A version whose queries all failed has no snapshot to report or diff
+        failed = [vid for vid in self.snapshot_ids if vid not in fetched and vid != selected]
+        for vid in failed:
+            print(f"  Warning: all queries failed for version {names.get(vid, vid)}, "
+                  f"leaving it out of the snapshots", file=sys.stderr)
+        self.snapshot_ids = [vid for vid in self.snapshot_ids if vid not in failed]
+        if len(self.snapshot_ids) > 1:
+            for vid in self.snapshot_ids:
+                incomplete = self.store.incomplete_types(vid)
+                if incomplete:
+                    detail = ", ".join(f"{t} ({reason})" for t, reason in sorted(incomplete.items()))
+                    print(f"  Warning: {names.get(vid, vid)} snapshot is incomplete for {detail}; "
+                          f"those types are left out of its diffs", file=sys.stderr)
+        
+        types_to_remove = []
+        for type_name, type_info in self.item_types.items():
+            records = self.all_records_by_type.get(type_name)
+            if not records:
                 types_to_remove.append(type_name)
+                continue
+            
+            type_info.count = totals[type_name]
+            
+            # Infer short name from docId patterns
+            for record in records[:20]:
+                # Look for docId in fields
+                for field_obj in record.get("fields", []):
+                    if isinstance(field_obj, dict) and field_obj.get("label") == "ID":
+                        doc_id = field_obj.get("value", "")
+                        if doc_id and "-" in str(doc_id):
+                            prefix = str(doc_id).split("-")[0]
+                            if prefix.isalpha() and 1 <= len(prefix) <= 6:
+                                type_info.shortName = prefix
+                                break
+                if type_info.shortName:
+                    break
+            
+            print(f"  {type_name}: {len(records)} records (total: {type_info.count})", file=sys.stderr)
         
         # Remove types with no records
         for type_name in types_to_remove:
             del self.item_types[type_name]
+        
+        if len(self.snapshot_ids) > 1:
+            storage = self.store.storage_stats()
+            print(f"  Stored {storage['uniqueRecords']} unique records for "
+                  f"{storage['recordReferences']} references across {storage['snapshots']} versions",
+                  file=sys.stderr)
     
     def _analyze_all_fields(self):
         """Analyze fields for all item types."""
@@ -404,18 +821,7 @@ class KetryxDataExtractor:
                 if not values:
                     continue
                 
-                # Determine data type
-                types = data["types"]
-                if self._is_rich_text_field(field_key, values):
-                    data_type = "richText"
-                elif "number" in types:
-                    data_type = "number"
-                elif "date" in types or "datetime" in types:
-                    data_type = "datetime"
-                elif "boolean" in types:
-                    data_type = "boolean"
-                else:
-                    data_type = "string"
+                data_type = classify_field(field_key, values, data["types"])
                 
                 # Compute access paths
                 access = self._compute_access_paths(field_key, is_custom, data_type)
@@ -448,31 +854,14 @@ class KetryxDataExtractor:
             
             type_info.statuses = sorted(type_info.statuses)
             
-            # Extract sample records
-            type_info.sampleRecords = self._build_sample_records(records, type_info.fields)
+            # Extract sample records, ranked against each field's value frequencies
+            frequency = {key: Counter(map(value_text, data["values"])) for key, data in field_data.items()}
+            type_info.sampleRecords = self._build_sample_records(records, type_info.fields, frequency)
     
     def _normalize_field_name(self, name: str) -> str:
         """Normalize field name: spaces -> underscores."""
         return name.replace(" ", "_")
     
-    def _is_rich_text_field(self, field_name: str, values: list) -> bool:
-        """Determine if a field contains rich text."""
-        lower_name = field_name.lower().replace("_", " ")
-        
-        for pattern in RICH_TEXT_FIELD_PATTERNS:
-            if pattern in lower_name:
-                return True
-        
-        html_indicators = ["<p>", "<ul>", "<ol>", "<li>", "<strong>", "<em>", "<br", "<div>", "<span>"]
-        for value in values[:10]:
-            if isinstance(value, str):
-                if any(tag in value for tag in html_indicators):
-                    return True
-                if len(value) > 500:
-                    return True
-        
-        return False
-    
     def _compute_access_paths(self, field_name: str, is_custom: bool, data_type: str) -> dict:
         """Compute all valid access paths for a field."""
         normalized = self._normalize_field_name(field_name)
@@ -506,6 +895,10 @@ class KetryxDataExtractor:
         if data_type == "richText":
             return [], []
         
+        if data_type == "list":
+            # Options of a multi-value field are its individual elements
+            values = [e for v in values for e in (v if isinstance(v, list) else [v])]
+        
         truncated = []
         for v in values:
             if isinstance(v, str):
@@ -513,45 +906,73 @@ class KetryxDataExtractor:
             else:
                 truncated.append(str(v))
         
-        unique = list(dict.fromkeys(truncated))
+        counts = Counter(truncated)
         
-        if len(unique) <= MAX_UNIQUE_VALUES:
-            return sorted(unique), []
+        if len(counts) <= MAX_UNIQUE_VALUES:
+            return sorted(counts), []
         else:
-            return [], unique[:MAX_SAMPLE_VALUES]
+            return [], select_exemplars(counts, MAX_SAMPLE_VALUES)
     
-    def _build_sample_records(self, records: list, fields: dict) -> list:
-        """Build sample records for AI pattern matching."""
-        samples = []
+    def _sample_fields(self, record: dict, fields: dict) -> dict:
+        """Non-rich custom field values of a record as strings, keyed by field."""
+        values = {}
+        for field_obj in record.get("fields", []):
+            if not isinstance(field_obj, dict):
+                continue
+            
+            label = field_obj.get("label", "")
+            value = field_obj.get("value")
+            normalized = self._normalize_field_name(label)
+            
+            if normalized in fields and fields[normalized].dataType == "richText":
+                continue
+            
+            if label and value and value != "":
+                values.setdefault(normalized, value_text(value))
+        return values
+    
+    def _build_sample_records(self, records: list, fields: dict, frequency: Dict[str, Counter]) -> list:
+        """Build sample records for AI pattern matching.
         
-        for record in records[:MAX_SAMPLE_RECORDS]:
+        Records are ranked in one pass over a fixed-size heap by the number of
+        fields they fill, how rare their values are within the type and how
+        many relations they carry. Each sample shows its rarest field values.
+        """
+        def rarity(name: str, value: str) -> float:
+            return 1 / max(frequency.get(name, {}).get(value, 1), 1)
+        
+        # (score, -index): ties keep the earlier record
+        heap = []
+        for index, record in enumerate(records):
             if not isinstance(record, dict):
                 continue
-            
+            values = self._sample_fields(record, fields)
+            relations = len(record.get("relations") or [])
+            score = (len(values) + sum(rarity(n, v) for n, v in values.items())
+                     + min(relations, MAX_SAMPLE_RELATIONS))
+            if len(heap) < MAX_SAMPLE_RECORDS:
+                heapq.heappush(heap, (score, -index))
+            else:
+                heapq.heappushpop(heap, (score, -index))
+        
+        samples = []
+        for _, negative_index in sorted(heap, reverse=True):
+            record = records[-negative_index]
+            values = self._sample_fields(record, fields)
             sample = {}
             
             # Standard fields
             if record.get("title"):
                 sample["title"] = self._truncate(str(record["title"]), 80)
             
-            # Custom fields
-            custom_count = 0
-            for field_obj in record.get("fields", []):
-                if custom_count >= 4:
-                    break
-                if not isinstance(field_obj, dict):
-                    continue
-                
-                label = field_obj.get("label", "")
-                value = field_obj.get("value")
-                normalized = self._normalize_field_name(label)
-                
-                if normalized in fields and fields[normalized].dataType == "richText":
-                    continue
-                
-                if label and value and value != "":
-                    sample[normalized] = self._truncate(str(value), 60)
-                    custom_count += 1
+            # Custom fields, rarest first, shown in record order
+            shown = set(heapq.nlargest(MAX_SAMPLE_FIELDS, values, key=lambda n: rarity(n, values[n])))
+            sample.update((n, self._truncate(v, 60)) for n, v in values.items() if n in shown)
+            
+            relation_types = [r.get("type") for r in record.get("relations") or []
+                              if isinstance(r, dict) and r.get("type")]
+            if relation_types:
+                sample["relations"] = list(dict.fromkeys(relation_types))[:MAX_SAMPLE_RELATIONS]
             
             if sample:
                 samples.append(sample)
@@ -623,7 +1044,7 @@ class KetryxDataExtractor:
             reverse=True
         )
         
-        return {
+        output = {
             "_meta": {
                 "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
                 "purpose": "AI-optimized project data for template generation",
@@ -632,8 +1053,11 @@ class KetryxDataExtractor:
                     "access.plain: Use in table cells, inline text, anywhere plain string is needed",
                     "access.rich: Use when HTML rendering is desired (prefixed with ~~)",
                     "kqlQuery: Pre-computed query to fetch all items of this type",
+                    "dataType: richText, number, datetime, boolean, enum (small fixed set of values), list (multi-value) or string",
                     "uniqueValues: All possible values (for categorical fields with <=25 values)",
-                    "exampleValues: Sample values (for fields with >25 unique values)",
+                    "exampleValues: Distinctive sample values, one per value pattern where possible (for fields with >25 unique values)",
+                    "sampleRecords: Records filling the most fields with the rarest values, with their relation types",
+                    "versionSnapshots: Per-version counts/statuses and New/Changed/Removed/Same diffs (multi-version runs only); incompleteTypes are not diffed",
                 ],
             },
             
@@ -675,12 +1099,76 @@ class KetryxDataExtractor:
                 r.to_dict() for r in sorted_relations[:20]
             ],
         }
+        
+        if len(self.snapshot_ids) > 1:
+            output["versionSnapshots"] = {
+                "versions": [self.store.version_stats(vid) for vid in self.snapshot_ids],
+                "diffs": [
+                    self.store.diff(old, new)
+                    for old, new in zip(self.snapshot_ids, self.snapshot_ids[1:])
+                ],
+                "storage": self.store.storage_stats(),
+            }
+        
+        return output
 
 
 # =============================================================================
 # Main
 # =============================================================================
 
+def run_profiled(fn, report_path: str):
+    """Run fn under a profiler, writing the report to report_path.
+    
+    Uses the pyinstrument sampling profiler when it is installed and falls
+    back to the standard library's cProfile otherwise.
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+    
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            return fn()
+        finally:
+            profiler.stop()
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html() if report_path.endswith(".html") else profiler.output_text())
+            print(f"Profile written to {report_path}", file=sys.stderr)
+    
+    import cProfile
+    import pstats
+    
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn)
+    finally:
+        profiler.dump_stats(report_path)
+        print(f"pyinstrument not installed; cProfile stats written to {report_path}", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+
+
+def report_metrics(args: argparse.Namespace, extractor: KetryxDataExtractor, error: str = None) -> None:
+    """Print the phase summary and write --metrics-out, for failed runs as well."""
+    extractor.metrics.print_summary()
+    if not args.metrics_out:
+        return
+    report = {
+        "generatedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "projectId": args.project_id,
+        "versionId": extractor.version_id,
+        "status": "failed" if error else "ok",
+        "error": error,
+        **extractor.metrics.to_dict(),
+    }
+    with open(args.metrics_out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Metrics written to {args.metrics_out}", file=sys.stderr)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Extract Ketryx project data into AI-optimized format"
@@ -690,6 +1178,14 @@ def main():
     parser.add_argument("--base-url", default=os.environ.get("KETRYX_BASE_URL", DEFAULT_BASE_URL), help="Ketryx base URL")
     parser.add_argument("--version-id", help="Specific version ID (default: latest)")
     parser.add_argument("--output", "-o", default="project_data.json", help="Output file")
+    parser.add_argument("--versions",
+                        help="Also snapshot other versions: 'all', N latest, or comma-separated IDs/names")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent record queries")
+    parser.add_argument("--snapshot-out", help="Write the deduplicated record store JSON to this file")
+    parser.add_argument("--metrics-out", help="Write per-phase/per-endpoint metrics JSON to this file")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Profile the run and write the report to PATH "
+                             "(pyinstrument if installed, else cProfile stats)")
     
     args = parser.parse_args()
     
@@ -697,16 +1193,25 @@ def main():
         print("Error: API key required. Use --api-key or set KETRYX_API_KEY", file=sys.stderr)
         sys.exit(1)
     
-    client = KetryxAPIClient(args.base_url, args.api_key)
-    extractor = KetryxDataExtractor(client, args.project_id, args.version_id)
+    metrics = ExtractionMetrics(trace_memory=bool(args.metrics_out or args.profile))
+    client = KetryxAPIClient(args.base_url, args.api_key, metrics)
+    extractor = KetryxDataExtractor(client, args.project_id, args.version_id,
+                                    snapshot_versions=args.versions, workers=args.workers)
     
     try:
-        data = extractor.extract()
+        if args.profile:
+            data = run_profiled(extractor.extract, args.profile)
+        else:
+            data = extractor.extract()
     except Exception as e:
         print(f"Extraction failed: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
+        report_metrics(args, extractor, error=f"{type(e).__name__}: {e}")
         sys.exit(1)
+    except KeyboardInterrupt:
+        report_metrics(args, extractor, error="interrupted")
+        raise
     
     output_json = json.dumps(data, indent=2, ensure_ascii=False)
     
@@ -717,6 +1222,12 @@ def main():
             f.write(output_json)
         print(f"\nOutput written to {args.output}", file=sys.stderr)
         print(f"Summary: {data['summary']['totalItems']} items across {data['summary']['itemTypeCount']} types", file=sys.stderr)
+    
+    if args.snapshot_out:
+        extractor.store.save(args.snapshot_out, project=data["project"])
+        print(f"Record store written to {args.snapshot_out}", file=sys.stderr)
+    
+    report_metrics(args, extractor)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Ketryx DOCX I/O
+
+Streaming access to .docx packages. Only the XML parts that carry template
+text (document body, headers, footers, notes and optionally numbering/styles)
+are ever decompressed. Everything else (media, fonts, themes, ...) is copied
+between archives as raw compressed bytes, so memory stays flat and output
+I/O is proportional to the XML that actually changed. The raw copy relies on
+ZipFile internals; it is self-checked once per process (verified on CPython
+3.8-3.13) and falls back to the public ZipFile API if the check fails.
+
+Usage:
+    python ketryx_docx_io.py input.docx            # list parts
+    python ketryx_docx_io.py input.docx --text     # dump body paragraph text
+"""
+
+import argparse
+import copy
+import functools
+import io
+import re
+import struct
+import sys
+import zipfile
+from typing import Dict, Iterator, List, Optional
+from xml.etree import ElementTree
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# Parts that hold user-visible template text
+TEXT_PART_PATTERN = re.compile(
+    r"^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$"
+)
+
+# Parts only needed when list/heading formatting has to be inspected
+STYLE_PARTS = ("word/numbering.xml", "word/styles.xml")
+
+REQUIRED_PARTS = ("[Content_Types].xml", "word/document.xml")
+
+# {project.name}, {#items}, {/items}, {$KQL x = ...}, {@toc}, {~~field}, ...
+TEMPLATE_TAG_PATTERN = re.compile(r"\{[#/$@^~]*[A-Za-z_][^{}]*\}")
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Local file header: signature, version, flags, method, time, date,
+# crc, compressed size, uncompressed size, name length, extra length
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_DATA_DESCRIPTOR_FLAG = 0x08
+
+
+# =============================================================================
+# Package access
+# =============================================================================
+
+class DocxPackage:
+    """Read-only view over a .docx archive that streams its members."""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._zip = zipfile.ZipFile(self.path, "r")
+        self._raw = open(self.path, "rb")
+
+    def __enter__(self) -> "DocxPackage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._zip.close()
+        self._raw.close()
+
+    def parts(self) -> List[str]:
+        """All member names in archive order."""
+        return [info.filename for info in self._zip.infolist()]
+
+    def text_parts(self, include_styles: bool = False) -> List[str]:
+        """Member names that need to be parsed for templating."""
+        names = [n for n in self.parts() if TEXT_PART_PATTERN.match(n)]
+        if include_styles:
+            names.extend(n for n in STYLE_PARTS if n in self._zip.NameToInfo)
+        return names
+
+    def info(self, name: str) -> zipfile.ZipInfo:
+        return self._zip.getinfo(name)
+
+    def open_part(self, name: str):
+        """Open a member as a decompressing stream."""
+        return self._zip.open(name, "r")
+
+    def read_part(self, name: str) -> bytes:
+        return self._zip.read(name)
+
+    def iter_paragraphs(self, name: str = "word/document.xml") -> Iterator[str]:
+        """Yield the text of each paragraph in a part without loading the whole tree."""
+        p_tag = f"{{{W_NS}}}p"
+        t_tag = f"{{{W_NS}}}t"
+        # Finished elements are detached from their parent as well as cleared,
+        # so the partial tree never grows with the document
+        stack = []
+        open_paragraphs = 0
+        with self.open_part(name) as stream:
+            for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+                if event == "start":
+                    stack.append(elem)
+                    open_paragraphs += elem.tag == p_tag
+                    continue
+                stack.pop()
+                if elem.tag == p_tag:
+                    open_paragraphs -= 1
+                    yield "".join(t.text or "" for t in elem.iter(t_tag))
+                elif open_paragraphs:
+                    # Runs and text are needed until their paragraph ends
+                    continue
+                elem.clear()
+                if stack:
+                    stack[-1].remove(elem)
+
+    def write(self, output_path: str, replacements: Optional[Dict[str, bytes]] = None) -> None:
+        """Write a copy of the package, swapping in replaced parts.
+
+        Replaced parts are compressed fresh; every other member is copied as
+        raw compressed bytes without a decompress/recompress round-trip.
+        Replacements naming parts that do not exist yet are appended.
+        """
+        replacements = dict(replacements or {})
+
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as dst:
+            for info in self._zip.infolist():
+                if info.filename in replacements:
+                    self._write_replacement(dst, info, replacements.pop(info.filename))
+                else:
+                    self._copy_raw(info, dst)
+
+            for name, data in replacements.items():
+                dst.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+
+    def _write_replacement(self, dst: zipfile.ZipFile, original: zipfile.ZipInfo, data: bytes) -> None:
+        zinfo = zipfile.ZipInfo(original.filename, date_time=original.date_time)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.external_attr = original.external_attr
+        dst.writestr(zinfo, data)
+
+    def _copy_raw(self, info: zipfile.ZipInfo, dst: zipfile.ZipFile) -> None:
+        """Copy a member's compressed bytes straight into another archive.
+
+        Falls back to a decompress/recompress through the public ZipFile API
+        when this Python's ZipFile internals do not support the raw copy.
+        """
+        if raw_copy_supported():
+            _copy_member_raw(self._raw, info, dst)
+        else:
+            zinfo = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            zinfo.compress_type = info.compress_type
+            zinfo.external_attr = info.external_attr
+            dst.writestr(zinfo, self._zip.read(info))
+
+
+def _copy_member_raw(src, info: zipfile.ZipInfo, dst: zipfile.ZipFile) -> None:
+    """Write a member's local header and compressed bytes from `src` into `dst`.
+
+    Uses ZipFile internals (fp, filelist, NameToInfo, start_dir, _didModify);
+    only called once raw_copy_supported() has checked they behave.
+    """
+    src.seek(info.header_offset)
+    header = src.read(_LOCAL_HEADER.size)
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = fields[9], fields[10]
+    src.seek(name_len + extra_len, 1)
+
+    zinfo = copy.copy(info)
+    # Sizes and CRC are known up front, so they go in the local header
+    zinfo.flag_bits &= ~_DATA_DESCRIPTOR_FLAG
+    zinfo.extra = b""
+
+    # Same bookkeeping ZipFile.write() does for directory entries
+    zinfo.header_offset = dst.fp.tell()
+    dst.fp.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+        dst.fp.write(chunk)
+        remaining -= len(chunk)
+    dst.filelist.append(zinfo)
+    dst.NameToInfo[zinfo.filename] = zinfo
+    dst.start_dir = dst.fp.tell()
+    dst._didModify = True
+
+
+@functools.lru_cache(maxsize=None)
+def raw_copy_supported() -> bool:
+    """Check once that a raw-copied archive round-trips on this Python."""
+    payload = b"<w:document/>" * 64
+    source = io.BytesIO()
+    with zipfile.ZipFile(source, "w", zipfile.ZIP_DEFLATED) as src:
+        src.writestr("word/document.xml", payload)
+        src.writestr("word/media/image1.png", payload, compress_type=zipfile.ZIP_STORED)
+    target = io.BytesIO()
+    try:
+        with zipfile.ZipFile(source, "r") as src, zipfile.ZipFile(target, "w") as dst:
+            for info in src.infolist():
+                _copy_member_raw(source, info, dst)
+        with zipfile.ZipFile(target, "r") as check:
+            return (check.testzip() is None
+                    and check.namelist() == ["word/document.xml", "word/media/image1.png"]
+                    and all(check.read(n) == payload for n in check.namelist()))
+    except (AttributeError, TypeError, ValueError, struct.error, zipfile.BadZipFile):
+        return False
+
+
+# =============================================================================
+# Validation
+# =============================================================================
+
+def validate_docx(path: str) -> Optional[str]:
+    """Return an error message if `path` is not a usable .docx, else None.
+
+    Only the required XML parts are decompressed and parsed; binary parts
+    are not touched.
+    """
+    if not zipfile.is_zipfile(path):
+        return "not a zip archive"
+    try:
+        with DocxPackage(path) as pkg:
+            names = set(pkg.parts())
+            missing = [n for n in REQUIRED_PARTS if n not in names]
+            if missing:
+                return f"missing parts: {', '.join(missing)}"
+            for name in REQUIRED_PARTS:
+                with pkg.open_part(name) as stream:
+                    for _ in ElementTree.iterparse(stream, events=("end",)):
+                        pass
+    except (zipfile.BadZipFile, ElementTree.ParseError, OSError) as e:
+        return str(e)
+    return None
+
+
+def count_template_tags(path: str) -> int:
+    """Count template tags across all text-bearing parts of a .docx."""
+    total = 0
+    with DocxPackage(path) as pkg:
+        for name in pkg.text_parts():
+            for text in pkg.iter_paragraphs(name):
+                total += len(TEMPLATE_TAG_PATTERN.findall(text))
+    return total
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a .docx package without unpacking it")
+    parser.add_argument("docx", help="Input Word document")
+    parser.add_argument("--text", action="store_true", help="Print body paragraph text")
+
+    args = parser.parse_args()
+
+    error = validate_docx(args.docx)
+    if error:
+        print(f"Error: {args.docx}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    with DocxPackage(args.docx) as pkg:
+        if args.text:
+            for text in pkg.iter_paragraphs():
+                if text.strip():
+                    print(text)
+            return
+
+        parsed = set(pkg.text_parts(include_styles=True))
+        for name in pkg.parts():
+            info = pkg.info(name)
+            marker = "xml" if name in parsed else "raw"
+            print(f"{marker}  {info.file_size:>10,}  {info.compress_size:>10,}  {name}")
+
+
+if __name__ == "__main__":
+    main()
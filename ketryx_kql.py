@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Ketryx Local KQL Engine
+
+Evaluates Ketryx Query Language filters (the `kqlSyntax` section of
+ketryx_template_syntax.json) against a record store written by
+`ketryx_data_extractor.py --snapshot-out`, without calling the Ketryx API.
+
+Supported: type:, state:, field:Name:Value, "title text", to:/from: relation
+subqueries, id:, diff: (against a comparison version), value lists
+`type:(A,"B C")`, OR groups `(type:A,type:B)`, implicit AND and NOT.
+
+Filters are answered from inverted indexes on type, state, field values and
+IDs plus forward/reverse relation indexes, so typical queries over 100k
+records take milliseconds.
+
+Usage:
+    python ketryx_kql.py --store ketryx_records.json 'type:Anomaly state:Open'
+    python ketryx_kql.py --store ketryx_records.json --count --version "Ketryx-1.2.0" \\
+        'type:Anomaly NOT state:Closed' 'to:type:"Software Requirement"'
+"""
+
+import argparse
+import gc
+import json
+import re
+import sys
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from ketryx_record_store import RecordStore, record_item_id, record_key, record_status
+
+
+# =============================================================================
+# Parser
+# =============================================================================
+
+FILTER_KEYS = {"type", "state", "field", "to", "from", "id", "diff"}
+
+TOKEN_PATTERN = re.compile(r'\s+|"((?:[^"\\]|\\.)*)"|([(),:])|([^\s(),:"]+)')
+
+
+class KQLSyntaxError(ValueError):
+    pass
+
+
+def tokenize(kql: str) -> List[tuple]:
+    """Split a query into ("str"|"word"|"punct", value) tokens."""
+    tokens = []
+    pos = 0
+    while pos < len(kql):
+        match = TOKEN_PATTERN.match(kql, pos)
+        if not match:
+            raise KQLSyntaxError(f"Unexpected character at {pos}: {kql[pos:pos + 10]!r}")
+        quoted, punct, word = match.groups()
+        if quoted is not None:
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", quoted)))
+        elif punct:
+            tokens.append(("punct", punct))
+        elif word:
+            tokens.append(("word", word))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive-descent parser producing nested tuples.
+
+    Node shapes: ("and", [nodes]), ("or", [nodes]), ("not", node),
+    ("text", str), (key, [values]) for type/state/id/diff,
+    ("field", name, [values]) and ("to" | "from", node).
+    """
+
+    def __init__(self, kql: str):
+        self.tokens = tokenize(kql)
+        self.pos = 0
+
+    def peek(self) -> Optional[tuple]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self) -> tuple:
+        token = self.peek()
+        if token is None:
+            raise KQLSyntaxError("Unexpected end of query")
+        self.pos += 1
+        return token
+
+    def expect(self, punct: str) -> None:
+        token = self.next()
+        if token != ("punct", punct):
+            raise KQLSyntaxError(f"Expected '{punct}', got {token[1]!r}")
+
+    def parse(self) -> tuple:
+        node = self.sequence()
+        if self.peek() is not None:
+            raise KQLSyntaxError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def sequence(self) -> tuple:
+        terms = []
+        while self.peek() is not None and self.peek() not in (("punct", ")"), ("punct", ",")):
+            terms.append(self.term())
+        if not terms:
+            raise KQLSyntaxError("Empty query")
+        return terms[0] if len(terms) == 1 else ("and", terms)
+
+    def term(self) -> tuple:
+        kind, value = self.next()
+
+        if kind == "word" and value == "NOT":
+            return ("not", self.term())
+
+        if (kind, value) == ("punct", "("):
+            alternatives = [self.sequence()]
+            while self.peek() == ("punct", ","):
+                self.next()
+                alternatives.append(self.sequence())
+            self.expect(")")
+            return alternatives[0] if len(alternatives) == 1 else ("or", alternatives)
+
+        if kind == "str":
+            return ("text", value)
+
+        if kind == "word" and self.peek() == ("punct", ":"):
+            key = value.lower()
+            if key not in FILTER_KEYS:
+                raise KQLSyntaxError(f"Unknown filter: {value}")
+            self.next()
+            if key in ("to", "from"):
+                return (key, self.term())
+            if key == "field":
+                name = self.atom()
+                self.expect(":")
+                return ("field", name, self.values())
+            return (key, self.values())
+
+        if kind == "word":
+            return ("text", value)
+
+        raise KQLSyntaxError(f"Unexpected {value!r}")
+
+    def atom(self) -> str:
+        kind, value = self.next()
+        if kind not in ("str", "word"):
+            raise KQLSyntaxError(f"Expected a value, got {value!r}")
+        return value
+
+    def values(self) -> List[str]:
+        if self.peek() != ("punct", "("):
+            return [self.atom()]
+        self.next()
+        values = [self.atom()]
+        while self.peek() == ("punct", ","):
+            self.next()
+            values.append(self.atom())
+        self.expect(")")
+        return values
+
+
+def parse(kql: str) -> tuple:
+    return _Parser(kql).parse()
+
+
+# =============================================================================
+# Index
+# =============================================================================
+
+# Longer field values (rich text bodies) are not worth an exact-match index entry
+MAX_INDEXED_VALUE_LENGTH = 256
+
+
+def _norm(value) -> str:
+    return str(value).casefold().strip()
+
+
+def _norm_label(label: str) -> str:
+    return _norm(label).replace("_", " ")
+
+
+class KQLIndex:
+    """Inverted indexes over one snapshot's records, answering parsed KQL."""
+
+    def __init__(self, records: Iterable[dict], previous: Iterable[dict] = None):
+        # Building creates millions of small objects; cyclic GC passes over the
+        # already-loaded records would dominate the build time
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(records, previous)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _build(self, records: Iterable[dict], previous: Optional[Iterable[dict]]) -> None:
+        self.records: Dict[str, dict] = {}
+        self.by_type: Dict[str, Set[str]] = defaultdict(set)
+        self.by_state: Dict[str, Set[str]] = defaultdict(set)
+        self.by_field: Dict[tuple, Set[str]] = defaultdict(set)
+        self.by_id: Dict[str, Set[str]] = defaultdict(set)
+        self.outgoing: Dict[str, Set[str]] = defaultdict(set)
+        self.incoming: Dict[str, Set[str]] = defaultdict(set)
+
+        norm_cache: Dict[str, str] = {}
+        titles = []
+        self._title_starts = []
+        offset = 0
+        for record in records:
+            item_id = record_item_id(record)
+            if not item_id or item_id in self.records:
+                continue
+            self.records[item_id] = record
+            self._index(item_id, record, norm_cache)
+
+            title = _norm(record.get("title") or "").replace("\n", " ")
+            self._title_starts.append(offset)
+            titles.append(title)
+            offset += len(title) + 1
+        self._titles = "\n".join(titles)
+        self._order = list(self.records)
+        self._position = {item_id: i for i, item_id in enumerate(self._order)}
+        self.universe = set(self.records)
+
+        self.diff_kinds: Dict[str, Set[str]] = defaultdict(set)
+        if previous is not None:
+            self._index_diff(previous)
+
+    def _index(self, item_id: str, record: dict, norm: Dict[str, str]) -> None:
+        self.by_type[_norm(record.get("type", ""))].add(item_id)
+
+        status = record_status(record)
+        if status:
+            self.by_state[_norm(status)].add(item_id)
+
+        for key in (item_id, record.get("id")):
+            if key:
+                self.by_id[_norm(key)].add(item_id)
+
+        for field_obj in record.get("fields", []):
+            if not isinstance(field_obj, dict):
+                continue
+            label = field_obj.get("label")
+            value = field_obj.get("value")
+            if not label or value is None or value == "":
+                continue
+            if label == "ID":
+                self.by_id[_norm(value)].add(item_id)
+
+            label_key = norm.get(label)
+            if label_key is None:
+                label_key = norm[label] = _norm_label(label)
+            for v in (value if isinstance(value, list) else [value]):
+                v = v if isinstance(v, str) else json.dumps(v, sort_keys=True, default=str)
+                if len(v) > MAX_INDEXED_VALUE_LENGTH:
+                    continue
+                # Field values repeat heavily across records, so normalize each once
+                value_key = norm.get(v)
+                if value_key is None:
+                    value_key = norm[v] = _norm(v)
+                self.by_field[(label_key, value_key)].add(item_id)
+
+        for relation in record.get("relations", []):
+            if not isinstance(relation, dict):
+                continue
+            target = relation.get("toItem") or relation.get("to") or {}
+            target_id = target.get("id") if isinstance(target, dict) else target
+            if target_id:
+                self.outgoing[item_id].add(target_id)
+                self.incoming[target_id].add(item_id)
+
+    def _index_diff(self, previous: Iterable[dict]) -> None:
+        previous_keys = {}
+        for record in previous:
+            item_id = record_item_id(record)
+            if item_id:
+                previous_keys[item_id] = (record_key(record), record)
+
+        for item_id, record in self.records.items():
+            old = previous_keys.get(item_id)
+            if old is None:
+                kind = "new"
+            elif old[0] == record_key(record):
+                kind = "same"
+            else:
+                kind = "changed"
+            self.diff_kinds[kind].add(item_id)
+
+        for item_id, (_, record) in previous_keys.items():
+            if item_id not in self.records:
+                # Removed items only exist in the comparison version; they are
+                # indexed but only returned by queries that ask for diff:Removed
+                self.records[item_id] = record
+                self._index(item_id, record, {})
+                self._position[item_id] = len(self._order)
+                self._order.append(item_id)
+                self.diff_kinds["removed"].add(item_id)
+
+    # -------------------------------------------------------------------------
+    # Evaluation
+    # -------------------------------------------------------------------------
+
+    def evaluate(self, node: tuple) -> Set[str]:
+        kind = node[0]
+
+        if kind == "and":
+            result = None
+            # Smallest sets first keeps intersections cheap
+            for part in sorted((self.evaluate(n) for n in node[1]), key=len):
+                result = part if result is None else result & part
+                if not result:
+                    break
+            return result or set()
+        if kind == "or":
+            return set().union(*(self.evaluate(n) for n in node[1]))
+        if kind == "not":
+            return self.universe - self.evaluate(node[1])
+        if kind == "type":
+            return set().union(*(self.by_type.get(_norm(v), set()) for v in node[1]))
+        if kind == "state":
+            return set().union(*(self.by_state.get(_norm(v), set()) for v in node[1]))
+        if kind == "id":
+            return set().union(*(self.by_id.get(_norm(v), set()) for v in node[1]))
+        if kind == "field":
+            label = _norm_label(node[1])
+            return set().union(*(self.by_field.get((label, _norm(v)), set()) for v in node[2]))
+        if kind == "diff":
+            return set().union(*(self.diff_kinds.get(_norm(v), set()) for v in node[1]))
+        if kind == "text":
+            return self._search_titles(_norm(node[1]))
+        if kind == "to":
+            targets = self.evaluate(node[1])
+            return set().union(*(self.incoming.get(t, set()) for t in targets)) & self.universe
+        if kind == "from":
+            sources = self.evaluate(node[1])
+            return set().union(*(self.outgoing.get(s, set()) for s in sources)) & self.universe
+        raise KQLSyntaxError(f"Unsupported node: {kind}")
+
+    def _search_titles(self, needle: str) -> Set[str]:
+        """Case-insensitive substring search over all titles in one pass."""
+        hits = set()
+        if not needle:
+            return hits
+        starts = self._title_starts
+        pos = self._titles.find(needle)
+        while pos != -1:
+            index = bisect_right(starts, pos) - 1
+            hits.add(self._order[index])
+            if index + 1 >= len(starts):
+                break
+            pos = self._titles.find(needle, starts[index + 1])
+        return hits
+
+    def matching_ids(self, kql: str) -> Set[str]:
+        node = parse(kql)
+        ids = self.evaluate(node)
+        if not _mentions_removed(node):
+            ids &= self.universe
+        return ids
+
+    def query(self, kql: str) -> List[dict]:
+        """Records matching `kql`, in snapshot order."""
+        ids = self.matching_ids(kql)
+        return [self.records[i] for i in sorted(ids, key=self._position.__getitem__)]
+
+    def count(self, kql: str) -> int:
+        return len(self.matching_ids(kql))
+
+
+def _mentions_removed(node: tuple) -> bool:
+    if node[0] == "diff":
+        return any(_norm(v) == "removed" for v in node[1])
+    children = node[1] if node[0] in ("and", "or") else [node[1]] if node[0] in ("not", "to", "from") else []
+    return any(_mentions_removed(child) for child in children)
+
+
+def index_for_version(store: RecordStore, version: str = None, compare_to: str = None) -> KQLIndex:
+    """Build an index for one stored version, optionally diffed against another."""
+    version_id = store.resolve_version(version)
+    previous = store.snapshot_records(store.resolve_version(compare_to)) if compare_to else None
+    return KQLIndex(store.snapshot_records(version_id), previous)
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def _record_summary(record: dict, fields: List[str]) -> dict:
+    summary = {"id": record_item_id(record), "type": record.get("type"), "title": record.get("title")}
+    for name in fields:
+        value = record.get(name)
+        if value is None:
+            value = next((f.get("value") for f in record.get("fields", [])
+                          if isinstance(f, dict) and _norm_label(f.get("label", "")) == _norm_label(name)), None)
+        summary[name] = value
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run KQL queries against a local Ketryx record store")
+    parser.add_argument("queries", nargs="+", help="KQL queries")
+    parser.add_argument("--store", required=True, help="Record store from ketryx_data_extractor.py --snapshot-out")
+    parser.add_argument("--version", help="Version ID or name (default: the extracted version)")
+    parser.add_argument("--compare", help="Version ID or name that diff: filters compare against")
+    parser.add_argument("--count", action="store_true", help="Only print match counts")
+    parser.add_argument("--fields", default="", help="Comma-separated extra fields to print per record")
+    parser.add_argument("--limit", type=int, default=20, help="Max records printed per query")
+
+    args = parser.parse_args()
+
+    store = RecordStore.load(args.store)
+    try:
+        start = time.perf_counter()
+        index = index_for_version(store, args.version, args.compare)
+        build_ms = (time.perf_counter() - start) * 1000
+    except KeyError as e:
+        print(f"Error: {e.args[0]}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Indexed {len(index.universe):,} records in {build_ms:.0f} ms", file=sys.stderr)
+    if args.compare:
+        incomplete = {**store.incomplete_types(store.resolve_version(args.compare)),
+                      **store.incomplete_types(store.resolve_version(args.version))}
+        if incomplete:
+            detail = ", ".join(f"{t} ({reason})" for t, reason in sorted(incomplete.items()))
+            print(f"Warning: diff: results are unreliable for incomplete types: {detail}", file=sys.stderr)
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()]
+    for kql in args.queries:
+        try:
+            start = time.perf_counter()
+            matches = index.query(kql)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except KQLSyntaxError as e:
+            print(f"Error in {kql!r}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        if args.count:
+            print(f"{len(matches)}\t{kql}")
+            continue
+        print(f"# {kql}: {len(matches)} matches ({elapsed_ms:.1f} ms)")
+        for record in matches[:args.limit]:
+            print(json.dumps(_record_summary(record, fields), ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Ketryx Template Pipeline
+
+Runs extract -> upload -> generate -> validate as one overlapped async job.
+Uploads of the documents and the syntax reference start while the project
+data is still being extracted, local document checks run alongside the
+network phases, and each template is validated as soon as it is downloaded.
+Several documents can flow through at once against a single extraction.
+
+Usage:
+    python ketryx_pipeline.py --project-id KXPRJ... \\
+        --docx Defect_Summary.docx Test_Report.docx \\
+        --syntax ketryx_template_syntax.json --output-dir templates/
+
+Environment variables:
+    ANTHROPIC_API_KEY: Anthropic API key
+    KETRYX_API_KEY: Ketryx API key (alternative to --api-key)
+    KETRYX_BASE_URL: Ketryx base URL (default: https://app.ketryx.com)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import anthropic
+
+from ketryx_data_extractor import DEFAULT_BASE_URL, KetryxAPIClient, KetryxDataExtractor
+from ketryx_docx_io import DocxPackage, count_template_tags, validate_docx
+from ketryx_template_agent import run_agent, upload_file
+
+
+# =============================================================================
+# Stages
+# =============================================================================
+
+def extract_project_data(base_url: str, api_key: str, project_id: str,
+                         version_id: Optional[str], output_path: str) -> str:
+    """Run the extractor and write its JSON; returns the output path."""
+    client = KetryxAPIClient(base_url, api_key)
+    data = KetryxDataExtractor(client, project_id, version_id).extract()
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"Project data written to {output_path}", file=sys.stderr)
+    return output_path
+
+
+def document_keys(docx_paths: List[str]) -> List[str]:
+    """Name for each document's template and work directory.
+
+    This is the file stem, plus a hash of the full path when several inputs
+    share that stem, so their outputs and checkpoints stay apart.
+    """
+    stems = [Path(p).stem for p in docx_paths]
+    keys = []
+    for path, stem in zip(docx_paths, stems):
+        if stems.count(stem) > 1:
+            digest = hashlib.sha1(str(Path(path).resolve()).encode()).hexdigest()[:8]
+            stem = f"{stem}-{digest}"
+        keys.append(stem)
+    return keys
+
+
+def analyze_docx(docx_path: str) -> dict:
+    """Local checks on an input document, done without unpacking it."""
+    error = validate_docx(docx_path)
+    if error:
+        return {"valid": False, "error": error}
+
+    with DocxPackage(docx_path) as pkg:
+        paragraphs = sum(1 for text in pkg.iter_paragraphs() if text.strip())
+        return {
+            "valid": True,
+            "paragraphs": paragraphs,
+            "textParts": pkg.text_parts(),
+        }
+
+
+def validate_template(template_path: str) -> dict:
+    """Check a generated template is a readable .docx containing template tags."""
+    if not Path(template_path).exists():
+        return {"valid": False, "error": "template was not downloaded"}
+
+    error = validate_docx(template_path)
+    if error:
+        return {"valid": False, "error": error}
+
+    tags = count_template_tags(template_path)
+    if not tags:
+        return {"valid": False, "error": "no template tags found", "tagCount": 0}
+    return {"valid": True, "tagCount": tags}
+
+
+# =============================================================================
+# Pipeline
+# =============================================================================
+
+class TemplatePipeline:
+    """Schedules the pipeline stages for a batch of documents."""
+
+    def __init__(self, client: anthropic.Anthropic, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.output_dir = Path(args.output_dir)
+        self.agent_slots = asyncio.Semaphore(args.concurrency)
+
+    async def run(self) -> List[dict]:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # Network and local work that does not depend on the project data
+        data_task = asyncio.create_task(self._data_file_id())
+        syntax_task = asyncio.create_task(self._upload(self.args.syntax))
+
+        keys = document_keys(self.args.docx)
+        jobs = [
+            self._process_document(docx_path, key, data_task, syntax_task)
+            for docx_path, key in zip(self.args.docx, keys)
+        ]
+        results = await asyncio.gather(*jobs)
+
+        # Documents rejected locally never await the shared inputs
+        for task in (data_task, syntax_task):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+        return results
+
+    async def _upload(self, path: str) -> str:
+        file_id = await asyncio.to_thread(upload_file, self.client, path)
+        print(f"  Uploaded {path} -> {file_id}")
+        return file_id
+
+    async def _data_file_id(self) -> str:
+        data_path = self.args.data
+        if not data_path:
+            data_path = await asyncio.to_thread(
+                extract_project_data,
+                self.args.base_url,
+                self.args.api_key,
+                self.args.project_id,
+                self.args.version_id,
+                str(self.output_dir / "ketryx_project_data.json"),
+            )
+        return await self._upload(data_path)
+
+    async def _process_document(self, docx_path: str, key: str,
+                                data_task: asyncio.Task, syntax_task: asyncio.Task) -> dict:
+        """Run one document through the pipeline; failures are recorded, not raised."""
+        started = time.monotonic()
+        output_path = str(self.output_dir / f"{key}_Template.docx")
+        result = {"document": docx_path, "output_path": output_path}
+
+        try:
+            await self._generate(docx_path, key, output_path, result, data_task, syntax_task)
+        except Exception as e:
+            print(f"  {docx_path}: {type(e).__name__}: {e}", file=sys.stderr)
+            result.update(success=False, error=f"{type(e).__name__}: {e}")
+
+        result["elapsedSeconds"] = round(time.monotonic() - started, 1)
+        return result
+
+    async def _generate(self, docx_path: str, key: str, output_path: str, result: dict,
+                        data_task: asyncio.Task, syntax_task: asyncio.Task) -> None:
+        analysis = await asyncio.to_thread(analyze_docx, docx_path)
+        result["analysis"] = analysis
+        if not analysis["valid"]:
+            result.update(success=False, error=f"invalid input: {analysis['error']}")
+            return
+
+        upload_task = asyncio.create_task(self._upload(docx_path))
+
+        # Shared inputs: a failed extraction or upload fails every valid document
+        try:
+            data_file_id, syntax_file_id = await asyncio.gather(data_task, syntax_task)
+        except Exception as e:
+            upload_task.cancel()
+            result.update(success=False, error=f"shared inputs failed: {type(e).__name__}: {e}")
+            return
+
+        docx_file_id = await upload_task
+
+        async with self.agent_slots:
+            agent_result = await asyncio.to_thread(
+                run_agent,
+                client=self.client,
+                docx_path=docx_path,
+                data_path=self.args.data or "",
+                syntax_path=self.args.syntax,
+                output_path=output_path,
+                model=self.args.model,
+                max_iterations=self.args.max_iterations,
+                cost_limit=self.args.cost_limit,
+                docx_file_id=docx_file_id,
+                data_file_id=data_file_id,
+                syntax_file_id=syntax_file_id,
+                max_stalled_turns=self.args.max_stalled_turns,
+                stop_on_first_file=self.args.stop_on_first_file,
+                working_dir=str(self.output_dir / "work" / key),
+                fast_model=self.args.fast_model,
+                escalation_model=self.args.escalation_model,
+                explore_turns=self.args.explore_turns,
+                resume=self.args.resume,
+            )
+        result.update(agent_result)
+
+        result["validation"] = await asyncio.to_thread(validate_template, output_path)
+        if result.get("success") and not result["validation"]["valid"]:
+            result.update(success=False, error=f"invalid template: {result['validation']['error']}")
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Ketryx extract -> template pipeline")
+    parser.add_argument("--docx", required=True, nargs="+", help="Input Word document(s)")
+    parser.add_argument("--syntax", required=True, help="Templating syntax reference JSON")
+    parser.add_argument("--output-dir", required=True, help="Directory for templates and project data")
+    parser.add_argument("--data", help="Existing project data JSON (skips extraction)")
+    parser.add_argument("--project-id", help="Ketryx project ID (KXPRJ...)")
+    parser.add_argument("--api-key", default=os.environ.get("KETRYX_API_KEY"), help="Ketryx API key")
+    parser.add_argument("--base-url", default=os.environ.get("KETRYX_BASE_URL", DEFAULT_BASE_URL), help="Ketryx base URL")
+    parser.add_argument("--version-id", help="Specific version ID (default: latest)")
+    parser.add_argument("--model", default="claude-sonnet-4-5-20250929")
+    parser.add_argument("--fast-model", help="Cheaper model for exploration turns")
+    parser.add_argument("--escalation-model", help="Model to escalate to on validation failure")
+    parser.add_argument("--explore-turns", type=int, default=2)
+    parser.add_argument("--max-iterations", type=int, default=15)
+    parser.add_argument("--cost-limit", type=float, default=10.0)
+    parser.add_argument("--max-stalled-turns", type=int, default=3)
+    parser.add_argument("--stop-on-first-file", action="store_true")
+    parser.add_argument("--resume", action="store_true", help="Continue interrupted agent runs from their checkpoints")
+    parser.add_argument("--concurrency", type=int, default=2, help="Agent sessions to run at once")
+
+    args = parser.parse_args()
+
+    if not args.data:
+        if not args.project_id:
+            print("Error: --project-id is required unless --data is given", file=sys.stderr)
+            sys.exit(1)
+        if not args.api_key:
+            print("Error: API key required. Use --api-key or set KETRYX_API_KEY", file=sys.stderr)
+            sys.exit(1)
+
+    for p in [args.syntax, args.data, *args.docx]:
+        if p and not Path(p).exists():
+            print(f"Error: not found: {p}", file=sys.stderr)
+            sys.exit(1)
+
+    pipeline = TemplatePipeline(anthropic.Anthropic(), args)
+    results = asyncio.run(pipeline.run())
+
+    summary_path = Path(args.output_dir) / "pipeline_results.json"
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    succeeded = sum(1 for r in results if r.get("success"))
+    total_cost = sum(r.get("total_cost", 0) for r in results)
+    print(f"\n{succeeded}/{len(results)} templates generated, total cost ${total_cost:.3f}")
+    spend = {}
+    for r in results:
+        for model, cost in r.get("cost_by_model", {}).items():
+            spend[model] = spend.get(model, 0.0) + cost
+    for model, cost in spend.items():
+        print(f"  {model}: ${cost:.3f}")
+    print(f"Results written to {summary_path}")
+
+    if succeeded < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Ketryx Record Store
+
+Content-addressed storage for records pulled from several project versions.
+Each record is stored once under its item ID and revision; a version snapshot
+is just the list of keys it contains, so records that did not change between
+versions are kept a single time. Per-version statistics and version-to-version
+diffs are computed from the keys alone.
+"""
+
+import hashlib
+import json
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Optional
+
+
+# Snapshot ID used when the project has no versions to filter by
+UNVERSIONED = "unversioned"
+
+DIFF_KINDS = ("New", "Changed", "Removed", "Same")
+
+
+def record_item_id(record: dict) -> str:
+    """Stable item identity shared by all revisions of a record."""
+    item = record.get("item")
+    if isinstance(item, dict) and item.get("id"):
+        return item["id"]
+    return record.get("itemId") or record.get("id") or ""
+
+
+def record_key(record: dict) -> str:
+    """Content address of a record: item ID plus revision (or a content hash)."""
+    revision = record.get("revision")
+    if revision is None or revision == "":
+        payload = json.dumps(record, sort_keys=True, default=str).encode()
+        revision = "sha1:" + hashlib.sha1(payload).hexdigest()[:16]
+    return f"{record_item_id(record)}@{revision}"
+
+
+def record_field(record: dict, label: str):
+    """Value of a custom field by label, or None."""
+    for field_obj in record.get("fields", []):
+        if isinstance(field_obj, dict) and field_obj.get("label") == label:
+            return field_obj.get("value")
+    return None
+
+
+def record_status(record: dict) -> Optional[str]:
+    return record.get("state") or record_field(record, "Status")
+
+
+class RecordStore:
+    """Deduplicated records plus per-version snapshots of record keys."""
+
+    def __init__(self):
+        self.records: Dict[str, dict] = {}
+        self.snapshots: Dict[str, dict] = {}
+        self.selected_version: Optional[str] = None
+
+    def add_records(self, version_id: str, version_name: str, records: List[dict]) -> int:
+        """Add records to a version snapshot; returns how many were new to the store."""
+        snapshot = self.snapshots.setdefault(version_id, {"name": version_name, "keys": []})
+        added = 0
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            key = record_key(record)
+            if key not in self.records:
+                self.records[key] = record
+                added += 1
+            snapshot["keys"].append(key)
+        return added
+
+    def mark_incomplete(self, version_id: str, version_name: str, type_name: str, reason: str) -> None:
+        """Flag a type whose records in a snapshot are missing or partial.
+
+        `reason` is "failed", "truncated" or "unversioned"; flagged types are
+        left out of diffs involving the snapshot.
+        """
+        snapshot = self.snapshots.setdefault(version_id, {"name": version_name, "keys": []})
+        snapshot.setdefault("incompleteTypes", {})[type_name] = reason
+
+    def incomplete_types(self, version_id: str) -> Dict[str, str]:
+        return dict(self.snapshots.get(version_id, {}).get("incompleteTypes", {}))
+
+    def resolve_version(self, version: str = None) -> str:
+        """Snapshot ID for a version ID or name; defaults to the selected version."""
+        if not version:
+            return self.selected_version or next(iter(self.snapshots), UNVERSIONED)
+        if version in self.snapshots:
+            return version
+        for version_id, snapshot in self.snapshots.items():
+            if (snapshot.get("name") or "").strip() == version.strip():
+                return version_id
+        raise KeyError(f"Unknown version: {version}")
+
+    def snapshot_records(self, version_id: str) -> Iterator[dict]:
+        for key in self.snapshots.get(version_id, {}).get("keys", []):
+            yield self.records[key]
+
+    def records_by_type(self, version_id: str) -> Dict[str, List[dict]]:
+        by_type = defaultdict(list)
+        for record in self.snapshot_records(version_id):
+            by_type[record.get("type", "")].append(record)
+        return dict(by_type)
+
+    def _items(self, version_id: str) -> Dict[str, str]:
+        """item ID -> record key for one snapshot."""
+        return {
+            key.rsplit("@", 1)[0]: key
+            for key in self.snapshots.get(version_id, {}).get("keys", [])
+        }
+
+    # -------------------------------------------------------------------------
+    # Statistics
+    # -------------------------------------------------------------------------
+
+    def version_stats(self, version_id: str) -> dict:
+        """Record counts, status counts and field fill rates per type for one snapshot."""
+        types = {}
+        for type_name, records in sorted(self.records_by_type(version_id).items()):
+            statuses = Counter()
+            filled = Counter()
+            for record in records:
+                status = record_status(record)
+                if status:
+                    statuses[status] += 1
+                for field_obj in record.get("fields", []):
+                    if isinstance(field_obj, dict) and field_obj.get("value") not in (None, ""):
+                        filled[field_obj.get("label", "")] += 1
+            types[type_name] = {
+                "count": len(records),
+                "statuses": dict(sorted(statuses.items())),
+                "fillRates": {
+                    label: f"{n / len(records) * 100:.0f}%"
+                    for label, n in sorted(filled.items()) if label
+                },
+            }
+        snapshot = self.snapshots.get(version_id, {})
+        stats = {
+            "id": version_id,
+            "name": snapshot.get("name"),
+            "itemCount": len(snapshot.get("keys", [])),
+            "types": types,
+        }
+        if snapshot.get("incompleteTypes"):
+            stats["incompleteTypes"] = dict(sorted(snapshot["incompleteTypes"].items()))
+        return stats
+
+    def diff(self, old_version: str, new_version: str) -> dict:
+        """New/Changed/Removed/Same counts per type between two snapshots.
+
+        Types flagged incomplete in either snapshot are not counted; they are
+        listed under incompleteTypes instead.
+        """
+        old_items = self._items(old_version)
+        new_items = self._items(new_version)
+        skipped = {**self.incomplete_types(old_version), **self.incomplete_types(new_version)}
+        per_type = defaultdict(lambda: dict.fromkeys(DIFF_KINDS, 0))
+
+        for item_id, key in new_items.items():
+            type_name = self.records[key].get("type", "")
+            if type_name in skipped:
+                continue
+            old_key = old_items.get(item_id)
+            kind = "New" if old_key is None else ("Same" if old_key == key else "Changed")
+            per_type[type_name][kind] += 1
+        for item_id, key in old_items.items():
+            type_name = self.records[key].get("type", "")
+            if item_id not in new_items and type_name not in skipped:
+                per_type[type_name]["Removed"] += 1
+
+        diff = {
+            "from": self.snapshots.get(old_version, {}).get("name", old_version),
+            "to": self.snapshots.get(new_version, {}).get("name", new_version),
+            "types": dict(sorted(per_type.items())),
+        }
+        if skipped:
+            diff["incompleteTypes"] = dict(sorted(skipped.items()))
+        return diff
+
+    def storage_stats(self) -> dict:
+        references = sum(len(s["keys"]) for s in self.snapshots.values())
+        return {
+            "snapshots": len(self.snapshots),
+            "recordReferences": references,
+            "uniqueRecords": len(self.records),
+        }
+
+    # -------------------------------------------------------------------------
+    # Persistence
+    # -------------------------------------------------------------------------
+
+    def save(self, path: str, project: dict = None) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "project": project or {},
+                "selectedVersion": self.selected_version,
+                "snapshots": self.snapshots,
+                "records": self.records,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "RecordStore":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        store = cls()
+        store.snapshots = data.get("snapshots", {})
+        store.records = data.get("records", {})
+        store.selected_version = data.get("selectedVersion")
+        return store
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+Ketryx Section-Parallel Templating
+
+Very large documents are split into independent sections along the heading
+hierarchy and table boundaries. Each section becomes its own small .docx,
+the sections are templated by concurrent agent sessions that share the
+uploaded reference files, and the templated bodies are stitched back into
+the original package. Wall-clock time follows the largest section instead
+of the whole document.
+
+Merging keeps the original package and replaces only the body of
+word/document.xml. $KQL variables that two sections define with different
+queries are renamed in the later section. Headers, footers and notes are
+owned by the first section's session.
+
+Used through `ketryx_template_agent.py --sections`. To inspect a split:
+    python ketryx_sections.py input.docx --out sections/ --max-section-kb 200
+"""
+
+import argparse
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+from xml.etree import ElementTree
+from xml.sax.saxutils import unescape
+
+import anthropic
+
+from ketryx_docx_io import TEXT_PART_PATTERN, W_NS, DocxPackage, validate_docx
+from ketryx_template_agent import upload_file, run_agent
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+DEFAULT_MAX_SECTION_BYTES = 200 * 1024
+
+RELATIONSHIPS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+
+# Start/end/empty tags, comments, processing instructions and CDATA
+XML_TOKEN_PATTERN = re.compile(r"<!--.*?-->|<\?.*?\?>|<!\[CDATA\[.*?\]\]>|<(/?)([^\s/>]+)[^>]*?(/?)>", re.S)
+NAMESPACE_DECL_PATTERN = re.compile(r'xmlns:([\w.-]+)="([^"]*)"')
+PREFIX_USE_PATTERN = re.compile(r'</?([\w.-]+):|\s([\w.-]+):[\w.-]+=')
+RELATIONSHIP_PATTERN = re.compile(r"<Relationship\s[^>]*?/>", re.S)
+ATTRIBUTE_PATTERN = re.compile(r'([\w:.-]+)="([^"]*)"')
+HEADING_NAME_PATTERN = re.compile(r"^heading\s*(\d)$", re.I)
+
+TEXT_RUN_PATTERN = re.compile(r"<(?:[\w.-]+:)?t(?:\s[^>]*)?>([^<]*)</(?:[\w.-]+:)?t>")
+
+# Matched against paragraph text, since Word splits one tag across several runs
+KQL_DEFINITION_PATTERN = re.compile(r"\{\$KQL\s+([A-Za-z_]\w*)\s*=\s*([^}]*)\}")
+
+STYLE_ID_PATTERN = re.compile(r'\bstyleId="([^"]+)"')
+NUMBERING_ID_PATTERN = re.compile(r'<(?:[\w.-]+:)?(?:num|abstractNum)\s[^>]*?(?:numId|abstractNumId)="(\d+)"')
+STYLE_PARTS = {"word/styles.xml": STYLE_ID_PATTERN, "word/numbering.xml": NUMBERING_ID_PATTERN}
+
+SECTION_INSTRUCTIONS = """
+This document is section {number} of {total} of a larger document that was split for parallel
+templating. Other sections are handled by separate sessions and merged afterwards.
+Section outline: {outline}
+
+- Template only the content in this document; do not add content from other sections.
+- Keep the body structure as is: do not add or remove page/section breaks.
+- Give $KQL variables names specific to this section's content.
+{ownership}"""
+
+HEADER_OWNER_NOTE = "- You own the headers, footers and footnotes: template them as well."
+HEADER_READONLY_NOTE = "- Do not change headers, footers or footnotes; another session templates them."
+
+
+# =============================================================================
+# Body parsing
+# =============================================================================
+
+def heading_styles(styles_xml: bytes) -> Dict[str, int]:
+    """Paragraph style ID -> heading level (1-based) from styles.xml."""
+    levels = {}
+    root = ElementTree.fromstring(styles_xml)
+    w = f"{{{W_NS}}}"
+    for style in root.iter(f"{w}style"):
+        style_id = style.get(f"{w}styleId")
+        name = style.find(f"{w}name")
+        name = name.get(f"{w}val", "") if name is not None else ""
+        outline = style.find(f"{w}pPr/{w}outlineLvl")
+        match = HEADING_NAME_PATTERN.match(name)
+        if outline is not None and outline.get(f"{w}val", "").isdigit():
+            levels[style_id] = int(outline.get(f"{w}val")) + 1
+        elif match:
+            levels[style_id] = int(match.group(1))
+        elif name.lower() == "title":
+            levels[style_id] = 1
+    return levels
+
+
+def _prefix_for(root_tag: str, namespace: str, default: str) -> str:
+    for prefix, uri in NAMESPACE_DECL_PATTERN.findall(root_tag):
+        if uri == namespace:
+            return prefix
+    return default
+
+
+def _root_tag(xml: str) -> re.Match:
+    """The document's root start tag (after the XML declaration)."""
+    return re.search(r"<(?![?!])[^>]+>", xml)
+
+
+def parse_body(xml: str, styles: Dict[str, int]) -> dict:
+    """Split document.xml into the text around the body and its top-level blocks.
+
+    Returns {"head", "blocks", "sectPr", "tail"}; each block is a dict with its
+    raw XML, kind ("heading", "table" or "block"), heading level and heading
+    text. Concatenating head + blocks + sectPr + tail gives the original XML
+    back, minus whitespace between body elements.
+    """
+    root = _root_tag(xml)
+    w = _prefix_for(root.group(0), W_NS, "w") + ":"
+    body_open = re.search(rf"<{re.escape(w)}body(\s[^>]*)?>", xml)
+    body_close = xml.rfind(f"</{w}body>")
+    if not body_open or body_close < 0:
+        raise ValueError("document.xml has no body")
+
+    blocks = []
+    depth = 0
+    start = None
+    for token in XML_TOKEN_PATTERN.finditer(xml, body_open.end(), body_close):
+        closing, name, empty = token.groups()
+        if name is None:
+            continue
+        if depth == 0 and not closing:
+            start = token.start()
+        if closing:
+            depth -= 1
+        elif not empty:
+            depth += 1
+        if depth == 0 and start is not None:
+            blocks.append(_block(xml[start:token.end()], w, styles))
+            start = None
+
+    sect_pr = ""
+    if blocks and blocks[-1]["tag"] == "sectPr":
+        sect_pr = blocks.pop()["xml"]
+    return {
+        "head": xml[:body_open.end()],
+        "blocks": blocks,
+        "sectPr": sect_pr,
+        "tail": xml[body_close:],
+    }
+
+
+def _block(xml: str, w: str, styles: Dict[str, int]) -> dict:
+    tag = re.match(r"<([^\s/>]+)", xml).group(1).split(":")[-1]
+    block = {"xml": xml, "tag": tag, "kind": "block", "level": None}
+    if tag == "tbl":
+        block["kind"] = "table"
+    elif tag == "p":
+        style = re.search(rf'<{re.escape(w)}pStyle {re.escape(w)}val="([^"]+)"', xml)
+        outline = re.search(rf'<{re.escape(w)}outlineLvl {re.escape(w)}val="(\d)"', xml)
+        level = int(outline.group(1)) + 1 if outline else styles.get(style.group(1)) if style else None
+        if level:
+            block.update(kind="heading", level=level)
+    if block["kind"] == "heading":
+        block["text"] = _text(xml)
+    return block
+
+
+def _text(xml: str) -> str:
+    return "".join(TEXT_RUN_PATTERN.findall(xml))
+
+
+# =============================================================================
+# Section planning
+# =============================================================================
+
+def _size(blocks: List[dict]) -> int:
+    return sum(len(b["xml"]) for b in blocks)
+
+
+def _split_at(blocks: List[dict], is_boundary) -> List[List[dict]]:
+    parts = [[]]
+    for i, block in enumerate(blocks):
+        if i and is_boundary(block, blocks[i - 1]) and parts[-1]:
+            parts.append([])
+        parts[-1].append(block)
+    return parts
+
+
+def _split(blocks: List[dict], max_bytes: int, level: int) -> List[List[dict]]:
+    """Recursively split at headings of increasing depth, then at table boundaries."""
+    if _size(blocks) <= max_bytes or len(blocks) == 1:
+        return [blocks]
+
+    if level <= 9:
+        parts = _split_at(blocks, lambda b, _: b["kind"] == "heading" and b["level"] <= level)
+        if len(parts) == 1:
+            return _split(blocks, max_bytes, level + 1)
+    else:
+        # No headings left: tables and the text between them are the last resort
+        parts = _split_at(blocks, lambda b, prev: (b["kind"] == "table") != (prev["kind"] == "table"))
+        if len(parts) == 1:
+            return [blocks]
+
+    result = []
+    for part in parts:
+        result.extend(_split(part, max_bytes, level + 1))
+    return result
+
+
+def plan_sections(blocks: List[dict], max_bytes: int = DEFAULT_MAX_SECTION_BYTES) -> List[List[dict]]:
+    """Group body blocks into sections of at most `max_bytes` of XML where possible.
+
+    Adjacent small parts are packed together again so the number of agent
+    sessions stays close to document size / `max_bytes`.
+    """
+    sections = []
+    for part in _split(blocks, max_bytes, 1):
+        if sections and _size(sections[-1]) + _size(part) <= max_bytes:
+            sections[-1].extend(part)
+        else:
+            sections.append(list(part))
+    return sections
+
+
+def _section_title(blocks: List[dict], number: int) -> str:
+    """First heading of the section, else the start of its first text."""
+    heading = next((b for b in blocks if b["kind"] == "heading" and b["text"].strip()), None)
+    if heading:
+        return heading["text"].strip()
+    text = next((t for t in (_text(b["xml"]).strip() for b in blocks) if t), "")
+    return f"{text[:40]}..." if len(text) > 40 else text or f"Section {number}"
+
+
+def split_document(docx_path: str, out_dir: str,
+                   max_bytes: int = DEFAULT_MAX_SECTION_BYTES) -> List[dict]:
+    """Write one .docx per section into `out_dir`; returns section descriptors."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    with DocxPackage(docx_path) as pkg:
+        names = set(pkg.parts())
+        styles = heading_styles(pkg.read_part("word/styles.xml")) if "word/styles.xml" in names else {}
+        body = parse_body(pkg.read_part(DOCUMENT_PART).decode("utf-8"), styles)
+        planned = plan_sections(body["blocks"], max_bytes)
+
+        sections = []
+        first = 0
+        for i, blocks in enumerate(planned):
+            path = out / f"section-{i + 1:02d}.docx"
+            xml = body["head"] + "".join(b["xml"] for b in blocks) + body["sectPr"] + body["tail"]
+            pkg.write(str(path), {DOCUMENT_PART: xml.encode("utf-8")})
+            sections.append({
+                "index": i,
+                "path": str(path),
+                "title": _section_title(blocks, i + 1),
+                "blocks": [first, first + len(blocks)],
+                "bytes": _size(blocks),
+            })
+            first += len(blocks)
+    return sections
+
+
+# =============================================================================
+# Merging
+# =============================================================================
+
+def _relationships(rels_xml: str) -> Dict[str, dict]:
+    rels = {}
+    for rel in RELATIONSHIP_PATTERN.findall(rels_xml):
+        attrs = dict(ATTRIBUTE_PATTERN.findall(rel))
+        rels[attrs.get("Id")] = {"xml": rel, **attrs}
+    return rels
+
+
+def _paragraph_runs(xml: str) -> List[List[tuple]]:
+    """(start, end) offsets of each paragraph's text nodes, in document order."""
+    paragraphs = []
+    stack: List[List[tuple]] = []
+    text_start = None
+    for token in XML_TOKEN_PATTERN.finditer(xml):
+        closing, name, empty = token.groups()
+        if name is None or empty:
+            continue
+        local = name.split(":")[-1]
+        if local == "p":
+            if not closing:
+                stack.append([])
+            elif stack:
+                paragraphs.append(stack.pop())
+        elif local == "t" and stack:
+            if not closing:
+                text_start = token.end()
+            elif text_start is not None:
+                stack[-1].append((text_start, token.start()))
+                text_start = None
+    return paragraphs
+
+
+def _kql_definitions(xml: str) -> List[tuple]:
+    """(name, normalized query) of every $KQL definition, read from paragraph text."""
+    definitions = []
+    for runs in _paragraph_runs(xml):
+        text = "".join(xml[start:end] for start, end in runs)
+        for name, query in KQL_DEFINITION_PATTERN.findall(text):
+            definitions.append((name, " ".join(unescape(query, {"&quot;": '"', "&apos;": "'"}).split())))
+    return definitions
+
+
+def _rename_variable(xml: str, old: str, new: str) -> str:
+    """Rename a $KQL variable in its definition, loops and references.
+
+    Tags are matched on paragraph text. The new name goes into the run where
+    the old one starts; characters of the old name in later runs are removed,
+    so the formatting of the surrounding text is kept.
+    """
+    pattern = re.compile(r"(\{\s*(?:\$KQL\s+|[#/^]\s*)?)" + re.escape(old) + r"(?!\w)")
+    edits = []
+    for runs in _paragraph_runs(xml):
+        chars = list("".join(xml[start:end] for start, end in runs))
+        matches = list(pattern.finditer("".join(chars)))
+        if not matches:
+            continue
+        for m in matches:
+            chars[m.end(1)] = new
+            for i in range(m.end(1) + 1, m.end()):
+                chars[i] = ""
+        offset = 0
+        for start, end in runs:
+            edits.append((start, end, "".join(chars[offset:offset + end - start])))
+            offset += end - start
+    for start, end, text in sorted(edits, reverse=True):
+        xml = xml[:start] + text + xml[end:]
+    return xml
+
+
+class SectionMerger:
+    """Stitches templated section bodies back into the original package."""
+
+    def __init__(self, docx_path: str):
+        self.docx_path = docx_path
+        with DocxPackage(docx_path) as pkg:
+            names = set(pkg.parts())
+            styles = heading_styles(pkg.read_part("word/styles.xml")) if "word/styles.xml" in names else {}
+            self.xml = pkg.read_part(DOCUMENT_PART).decode("utf-8")
+            self.rels_xml = pkg.read_part(DOCUMENT_RELS_PART).decode("utf-8") if DOCUMENT_RELS_PART in names else None
+            self.parts = {n: pkg.read_part(n) for n in pkg.text_parts() if n != DOCUMENT_PART}
+            self.style_ids = {
+                name: set(pattern.findall(pkg.read_part(name).decode("utf-8"))) if name in names else set()
+                for name, pattern in STYLE_PARTS.items()
+            }
+
+        self.body = parse_body(self.xml, styles)
+        root = _root_tag(self.xml)
+        self.root_tag = self.xml[root.start():root.end()]
+        self.namespaces = dict(NAMESPACE_DECL_PATTERN.findall(self.root_tag))
+        self.relationships = _relationships(self.rels_xml or "")
+        self.new_namespaces: Dict[str, str] = {}
+        self.new_relationships: List[str] = []
+        self.variables: Dict[str, str] = {}
+        self.renamed: List[dict] = []
+        self.warnings: List[str] = []
+
+    def section_body(self, section: dict, template_path: str) -> str:
+        """Templated body XML of one section; raises ValueError if it cannot be merged."""
+        with DocxPackage(template_path) as pkg:
+            xml = pkg.read_part(DOCUMENT_PART).decode("utf-8")
+            rels_xml = pkg.read_part(DOCUMENT_RELS_PART).decode("utf-8") if DOCUMENT_RELS_PART in pkg.parts() else ""
+            self._check_styles(section, pkg)
+
+        body = parse_body(xml, {})
+        fragment = "".join(b["xml"] for b in body["blocks"])
+        root = _root_tag(xml)
+        fragment = self._check_namespaces(fragment, dict(NAMESPACE_DECL_PATTERN.findall(xml[root.start():root.end()])))
+        fragment = self._check_relationships(fragment, _relationships(rels_xml))
+        return self._resolve_variables(section, fragment)
+
+    def _check_namespaces(self, fragment: str, section_namespaces: Dict[str, str]) -> str:
+        markup = re.sub(r">[^<]+<", "><", fragment)
+        # Prefixes declared inside the fragment itself need no root declaration
+        local = {prefix for prefix, _ in NAMESPACE_DECL_PATTERN.findall(markup)}
+        for prefix in {a or b for a, b in PREFIX_USE_PATTERN.findall(markup)} - local - {"xml", "xmlns"}:
+            uri = section_namespaces.get(prefix)
+            known = self.namespaces.get(prefix) or self.new_namespaces.get(prefix)
+            if uri is None:
+                raise ValueError(f"undeclared namespace prefix '{prefix}'")
+            if known is None:
+                self.new_namespaces[prefix] = uri
+            elif known != uri:
+                raise ValueError(f"namespace prefix '{prefix}' was rebound to {uri}")
+        return fragment
+
+    def _check_relationships(self, fragment: str, section_rels: Dict[str, dict]) -> str:
+        r = _prefix_for(self.root_tag, RELATIONSHIPS_NS, "r")
+        for rel_id in set(re.findall(rf'\s{re.escape(r)}:\w+="([^"]+)"', fragment)):
+            ours, theirs = self.relationships.get(rel_id), section_rels.get(rel_id)
+            if theirs is None:
+                raise ValueError(f"relationship {rel_id} is missing")
+            if ours and ours.get("Target") == theirs.get("Target"):
+                continue
+            if theirs.get("TargetMode") != "External":
+                raise ValueError(f"adds embedded part {theirs.get('Target')}; template it in a single session")
+            # New hyperlinks get an ID that cannot clash with the original or other sections
+            new_id = f"rIdSec{len(self.new_relationships) + 1}"
+            self.new_relationships.append(theirs["xml"].replace(f'Id="{rel_id}"', f'Id="{new_id}"'))
+            fragment = re.sub(rf'(\s{re.escape(r)}:\w+=)"{re.escape(rel_id)}"', rf'\1"{new_id}"', fragment)
+        return fragment
+
+    def _check_styles(self, section: dict, pkg: DocxPackage) -> None:
+        """Warn about styles or numbering a section adds; only the body is merged."""
+        parts = set(pkg.parts())
+        for name, pattern in STYLE_PARTS.items():
+            if name not in parts:
+                continue
+            added = set(pattern.findall(pkg.read_part(name).decode("utf-8"))) - self.style_ids[name]
+            if added:
+                self.warnings.append(
+                    f"section {section['index'] + 1} added {name} entries {', '.join(sorted(added))}; "
+                    "they are dropped on merge and fall back to the original formatting"
+                )
+
+    def _resolve_variables(self, section: dict, fragment: str) -> str:
+        for name, query in _kql_definitions(fragment):
+            known = self.variables.get(name)
+            if known is None or known == query:
+                self.variables[name] = query
+                continue
+            new_name = f"{name}_s{section['index'] + 1}"
+            suffix = 2
+            while new_name in self.variables:
+                new_name = f"{name}_s{section['index'] + 1}_{suffix}"
+                suffix += 1
+            fragment = _rename_variable(fragment, name, new_name)
+            self.variables[new_name] = query
+            self.renamed.append({"section": section["index"] + 1, "from": name, "to": new_name})
+        return fragment
+
+    def write(self, sections: List[dict], output_path: str) -> List[dict]:
+        """Merge templated sections into `output_path`; returns per-section merge reports.
+
+        Sections without a usable template keep their original content.
+        """
+        reports = []
+        bodies = []
+        for section in sections:
+            start, end = section["blocks"]
+            original = "".join(b["xml"] for b in self.body["blocks"][start:end])
+            report = {"section": section["index"] + 1, "title": section["title"], "merged": False}
+            template = section.get("template")
+            if template and Path(template).exists():
+                try:
+                    bodies.append(self.section_body(section, template))
+                    report["merged"] = True
+                except (ValueError, KeyError) as e:
+                    report["error"] = str(e)
+            else:
+                report["error"] = section.get("error") or "no template"
+            if not report["merged"]:
+                bodies.append(self._resolve_variables(section, original))
+            reports.append(report)
+
+        head = self.body["head"]
+        if self.new_namespaces:
+            declarations = "".join(f' xmlns:{p}="{uri}"' for p, uri in sorted(self.new_namespaces.items()))
+            new_root = self.root_tag[:-1] + declarations + ">"
+            head = head.replace(self.root_tag, new_root, 1)
+        xml = head + "".join(bodies) + self.body["sectPr"] + self.body["tail"]
+
+        replacements = {DOCUMENT_PART: xml.encode("utf-8")}
+        if self.new_relationships:
+            rels = self.rels_xml.replace("</Relationships>", "".join(self.new_relationships) + "</Relationships>")
+            replacements[DOCUMENT_RELS_PART] = rels.encode("utf-8")
+        replacements.update(self._owned_parts(sections))
+
+        with DocxPackage(self.docx_path) as pkg:
+            pkg.write(output_path, replacements)
+        return reports
+
+    def _owned_parts(self, sections: List[dict]) -> Dict[str, bytes]:
+        """Headers, footers and notes as templated by the first section's session."""
+        template = sections[0].get("template") if sections else None
+        if not template or not Path(template).exists():
+            return {}
+        changed = {}
+        with DocxPackage(template) as pkg:
+            for name in pkg.text_parts():
+                if name in self.parts and TEXT_PART_PATTERN.match(name):
+                    data = pkg.read_part(name)
+                    if data != self.parts[name]:
+                        changed[name] = data
+        return changed
+
+
+# =============================================================================
+# Orchestration
+# =============================================================================
+
+def section_instructions(section: dict, sections: List[dict]) -> str:
+    outline = "; ".join(
+        f"{s['index'] + 1}. {s['title']}" + (" (this section)" if s is section else "")
+        for s in sections
+    )
+    return SECTION_INSTRUCTIONS.format(
+        number=section["index"] + 1,
+        total=len(sections),
+        outline=outline,
+        ownership=HEADER_OWNER_NOTE if section["index"] == 0 else HEADER_READONLY_NOTE,
+    )
+
+
+def run_sectioned(
+    client: anthropic.Anthropic,
+    docx_path: str,
+    data_path: str,
+    syntax_path: str,
+    output_path: str,
+    working_dir: str = "./work",
+    max_section_bytes: int = DEFAULT_MAX_SECTION_BYTES,
+    concurrency: int = 4,
+    data_file_id: str = None,
+    syntax_file_id: str = None,
+    **agent_options
+) -> dict:
+    """Template a large document as concurrently processed sections.
+
+    `agent_options` are passed to run_agent for every section; `cost_limit`
+    and `max_iterations` apply per section.
+    """
+    section_dir = Path(working_dir) / f"sections-{Path(docx_path).stem}"
+    sections = split_document(docx_path, str(section_dir), max_section_bytes)
+    print(f"Split {docx_path} into {len(sections)} sections:")
+    for s in sections:
+        print(f"  {s['index'] + 1:>3}. {s['title'][:60]:<60} {s['bytes'] / 1024:>8.0f} KB")
+
+    # Reference files are shared by every session
+    data_file_id = data_file_id or upload_file(client, data_path)
+    syntax_file_id = syntax_file_id or upload_file(client, syntax_path)
+
+    def run_section(section: dict) -> dict:
+        template = str(section_dir / f"section-{section['index'] + 1:02d}_Template.docx")
+        try:
+            result = run_agent(
+                client=client,
+                docx_path=section["path"],
+                data_path=data_path,
+                syntax_path=syntax_path,
+                output_path=template,
+                data_file_id=data_file_id,
+                syntax_file_id=syntax_file_id,
+                working_dir=str(section_dir),
+                extra_instructions=section_instructions(section, sections),
+                **agent_options
+            )
+        except Exception as e:
+            # One broken section keeps its original content instead of failing the run
+            result = {"success": False, "error": f"{type(e).__name__}: {e}", "total_cost": 0.0}
+        if result.get("success"):
+            section["template"] = template
+        else:
+            section["error"] = result.get("error")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(run_section, sections))
+
+    merger = SectionMerger(docx_path)
+    reports = merger.write(sections, output_path)
+    error = validate_docx(output_path)
+
+    spend: Dict[str, float] = {}
+    for result in results:
+        for model, cost in result.get("cost_by_model", {}).items():
+            spend[model] = spend.get(model, 0.0) + cost
+    failed = [r for r in reports if not r["merged"]]
+
+    print(f"\nMerged {len(sections) - len(failed)}/{len(sections)} sections into {output_path}")
+    for r in failed:
+        print(f"  ✗ Section {r['section']} ({r['title']}): {r['error']} - original content kept")
+    for rename in merger.renamed:
+        print(f"  Renamed ${rename['from']} -> ${rename['to']} in section {rename['section']}")
+    for warning in merger.warnings:
+        print(f"  Warning: {warning}")
+
+    return {
+        "success": not failed and error is None,
+        "output_path": output_path,
+        "total_cost": sum(r.get("total_cost", 0) for r in results),
+        "cost_by_model": spend,
+        "sections": reports,
+        "renamedVariables": merger.renamed,
+        "warnings": merger.warnings,
+        "error": error or (f"{len(failed)} of {len(sections)} sections not templated" if failed else None),
+    }
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a .docx into sections for parallel templating")
+    parser.add_argument("docx", help="Input Word document")
+    parser.add_argument("--out", required=True, help="Directory for the section documents")
+    parser.add_argument("--max-section-kb", type=int, default=DEFAULT_MAX_SECTION_BYTES // 1024,
+                        help="Target maximum body XML per section")
+
+    args = parser.parse_args()
+
+    error = validate_docx(args.docx)
+    if error:
+        print(f"Error: {args.docx}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    sections = split_document(args.docx, args.out, args.max_section_kb * 1024)
+    for s in sections:
+        print(f"{s['index'] + 1:>3}  {s['bytes'] / 1024:>8.0f} KB  blocks {s['blocks'][0]}-{s['blocks'][1]}  {s['title']}")
+
+
+if __name__ == "__main__":
+    main()
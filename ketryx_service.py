@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Ketryx Template Service
+
+Long-running local server for template generation. The Anthropic client, the
+Ketryx API session, uploaded file IDs and extracted project data stay warm
+between jobs, so a job only pays for the model turns. Jobs go into a bounded
+queue served by a fixed number of worker threads.
+
+Usage:
+    python ketryx_service.py --syntax ketryx_template_syntax.json \\
+        --data ketryx_project_data.json --output-dir service_out --port 8765
+
+    curl -X POST localhost:8765/jobs -H 'Content-Type: application/json' -d '{"docx": "/path/Defect_Summary.docx"}'
+    curl localhost:8765/jobs/<job id>
+
+Endpoints:
+    GET  /health         Queue depth, worker count and cache sizes
+    POST /jobs           Submit a job (application/json); 202 with the job ID, 503 if the queue is full
+    GET  /jobs           Summaries of queued, running and recent jobs
+    GET  /jobs/<id>      Full job status and result
+
+Job fields: docx (required), outputPath (inside --output-dir), data, projectId, versionId,
+refreshData, model, fastModel, escalationModel, exploreTurns, maxIterations,
+costLimit, maxStalledTurns, stopOnFirstFile.
+
+Environment variables:
+    ANTHROPIC_API_KEY: Anthropic API key
+    KETRYX_API_KEY: Ketryx API key (needed for jobs that name a projectId)
+    KETRYX_BASE_URL: Ketryx base URL (default: https://app.ketryx.com)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+
+import anthropic
+
+from ketryx_data_extractor import DEFAULT_BASE_URL, ExtractionMetrics, KetryxAPIClient, KetryxDataExtractor
+from ketryx_pipeline import validate_template
+from ketryx_template_agent import run_agent, upload_file
+
+
+# Finished jobs kept for status queries before the oldest are dropped
+MAX_FINISHED_JOBS = 500
+
+
+# =============================================================================
+# Warm caches
+# =============================================================================
+
+def _file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileIdCache:
+    """Uploaded file IDs keyed by content hash, so each distinct file is uploaded once."""
+
+    def __init__(self, client: anthropic.Anthropic):
+        self.client = client
+        self._ids: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+
+    def file_id(self, path: str) -> str:
+        digest = _file_digest(path)
+        with self._lock:
+            key_lock = self._key_locks[digest]
+        # Concurrent jobs for the same file wait for one upload
+        with key_lock:
+            if digest not in self._ids:
+                self._ids[digest] = upload_file(self.client, path)
+                print(f"  Uploaded {path} -> {self._ids[digest]}")
+            return self._ids[digest]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class ProjectDataCache:
+    """Project data per (project, version): parsed JSON, file on disk and uploaded file ID."""
+
+    def __init__(self, files: FileIdCache, ketryx: Optional[KetryxAPIClient], data_dir: Path):
+        self.files = files
+        self.ketryx = ketryx
+        self.data_dir = data_dir
+        self._entries: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+
+    def from_file(self, path: str) -> dict:
+        key = ("file", str(Path(path).resolve()))
+        with self._lock:
+            key_lock = self._key_locks[key]
+        with key_lock:
+            entry = self._entries.get(key)
+            # Reload when the file has been regenerated since it was cached
+            mtime = Path(path).stat().st_mtime
+            if entry is None or entry["mtime"] != mtime:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                entry = {"path": path, "mtime": mtime, "data": data, "fileId": self.files.file_id(path)}
+                self._entries[key] = entry
+            return entry
+
+    def from_project(self, project_id: str, version_id: str = None, refresh: bool = False) -> dict:
+        if self.ketryx is None:
+            raise ValueError("projectId jobs need a Ketryx API key (--api-key or KETRYX_API_KEY)")
+
+        key = ("project", project_id, version_id)
+        with self._lock:
+            key_lock = self._key_locks[key]
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is None or refresh:
+                print(f"Extracting project data for {project_id} ({version_id or 'latest'})...")
+                # Fresh metrics per extraction; the shared client's would grow with every job
+                client = self.ketryx.with_metrics(ExtractionMetrics())
+                data = KetryxDataExtractor(client, project_id, version_id).extract()
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+                path = self.data_dir / f"{project_id}_{version_id or 'latest'}.json"
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                entry = {"path": str(path), "extractedAt": time.time(), "data": data,
+                         "fileId": self.files.file_id(str(path))}
+                self._entries[key] = entry
+            return entry
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# =============================================================================
+# Service
+# =============================================================================
+
+class TemplateService:
+    """Job queue, workers and warm state shared by all jobs."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.output_dir = Path(args.output_dir)
+        self.client = anthropic.Anthropic()
+        ketryx = KetryxAPIClient(args.base_url, args.api_key) if args.api_key else None
+        self.files = FileIdCache(self.client)
+        self.project_data = ProjectDataCache(self.files, ketryx, self.output_dir / "data")
+
+        self.queue: "queue.Queue[dict]" = queue.Queue(maxsize=args.queue_size)
+        self.jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.jobs_lock = threading.Lock()
+        self.running = 0
+        self.syntax_file_id = None
+
+    def start(self) -> None:
+        """Upload shared inputs, load default project data and start the workers."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        print("Warming up...")
+        self.syntax_file_id = self.files.file_id(self.args.syntax)
+        if self.args.data:
+            self.project_data.from_file(self.args.data)
+        elif self.args.project_id:
+            self.project_data.from_project(self.args.project_id, self.args.version_id)
+
+        for i in range(self.args.workers):
+            threading.Thread(target=self._worker, name=f"worker-{i}", daemon=True).start()
+
+    # -------------------------------------------------------------------------
+    # Jobs
+    # -------------------------------------------------------------------------
+
+    def submit(self, spec: dict) -> dict:
+        """Validate and enqueue a job; raises ValueError or queue.Full."""
+        docx_path = spec.get("docx")
+        if not docx_path:
+            raise ValueError("'docx' is required")
+        if not Path(docx_path).exists():
+            raise ValueError(f"docx not found: {docx_path}")
+        if spec.get("data") and not Path(spec["data"]).exists():
+            raise ValueError(f"data not found: {spec['data']}")
+        if not (spec.get("data") or spec.get("projectId") or self.args.data or self.args.project_id):
+            raise ValueError("no project data: give 'data' or 'projectId', or start the service with one")
+        if spec.get("outputPath"):
+            spec["outputPath"] = str(self._output_path(spec["outputPath"]))
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "spec": spec,
+            "submittedAt": time.time(),
+            "startedAt": None,
+            "finishedAt": None,
+            "result": None,
+            "error": None,
+        }
+        with self.jobs_lock:
+            self.queue.put_nowait(job)
+            self.jobs[job_id] = job
+            self._prune()
+        return job
+
+    def _output_path(self, requested: str) -> Path:
+        """Resolve a job's outputPath; it must stay inside --output-dir."""
+        root = self.output_dir.resolve()
+        path = (root / requested).resolve()
+        if path == root or root not in path.parents:
+            raise ValueError(f"outputPath must be inside the output directory: {requested}")
+        return path
+
+    def _prune(self) -> None:
+        finished = [j for j in self.jobs.values() if j["status"] in ("done", "failed")]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job["id"]]
+
+    def _worker(self) -> None:
+        while True:
+            job = self.queue.get()
+            with self.jobs_lock:
+                job["status"] = "running"
+                job["startedAt"] = time.time()
+                self.running += 1
+            try:
+                job["result"] = self._run_job(job)
+                job["status"] = "done" if job["result"].get("success") else "failed"
+                job["error"] = job["result"].get("error")
+            except Exception as e:
+                traceback.print_exc()
+                job["status"] = "failed"
+                job["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                with self.jobs_lock:
+                    job["finishedAt"] = time.time()
+                    self.running -= 1
+                self.queue.task_done()
+            print(f"Job {job['id']} {job['status']} in {job['finishedAt'] - job['startedAt']:.1f}s")
+
+    def _resolve_data(self, spec: dict) -> dict:
+        if spec.get("data"):
+            return self.project_data.from_file(spec["data"])
+        if spec.get("projectId"):
+            return self.project_data.from_project(spec["projectId"], spec.get("versionId"),
+                                                  refresh=bool(spec.get("refreshData")))
+        if self.args.data:
+            return self.project_data.from_file(self.args.data)
+        return self.project_data.from_project(self.args.project_id, self.args.version_id,
+                                              refresh=bool(spec.get("refreshData")))
+
+    def _run_job(self, job: dict) -> dict:
+        spec = job["spec"]
+        args = self.args
+        docx_path = spec["docx"]
+        output_path = spec.get("outputPath") or str(
+            self.output_dir / job["id"] / f"{Path(docx_path).stem}_Template.docx"
+        )
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+        data = self._resolve_data(spec)
+        result = run_agent(
+            client=self.client,
+            docx_path=docx_path,
+            data_path=data["path"],
+            syntax_path=args.syntax,
+            output_path=output_path,
+            model=spec.get("model", args.model),
+            max_iterations=int(spec.get("maxIterations", args.max_iterations)),
+            cost_limit=float(spec.get("costLimit", args.cost_limit)),
+            docx_file_id=self.files.file_id(docx_path),
+            data_file_id=data["fileId"],
+            syntax_file_id=self.syntax_file_id,
+            max_stalled_turns=int(spec.get("maxStalledTurns", args.max_stalled_turns)),
+            stop_on_first_file=bool(spec.get("stopOnFirstFile", args.stop_on_first_file)),
+            working_dir=str(self.output_dir / "work" / job["id"]),
+            fast_model=spec.get("fastModel", args.fast_model),
+            escalation_model=spec.get("escalationModel", args.escalation_model),
+            explore_turns=int(spec.get("exploreTurns", args.explore_turns)),
+        )
+
+        result["validation"] = validate_template(output_path)
+        if result.get("success") and not result["validation"]["valid"]:
+            result.update(success=False, error=f"invalid template: {result['validation']['error']}")
+        return result
+
+    # -------------------------------------------------------------------------
+    # Views
+    # -------------------------------------------------------------------------
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "workers": self.args.workers,
+            "running": self.running,
+            "queued": self.queue.qsize(),
+            "queueSize": self.args.queue_size,
+            "cachedFiles": len(self.files),
+            "cachedProjectData": len(self.project_data),
+        }
+
+    def job_view(self, job: dict, full: bool = True) -> dict:
+        view = {k: job[k] for k in ("id", "status", "submittedAt", "startedAt", "finishedAt", "error")}
+        view["docx"] = job["spec"].get("docx")
+        if job["startedAt"]:
+            view["queueSeconds"] = round(job["startedAt"] - job["submittedAt"], 2)
+        if job["finishedAt"]:
+            view["runSeconds"] = round(job["finishedAt"] - job["startedAt"], 2)
+        if full:
+            view["spec"] = job["spec"]
+            view["result"] = job["result"]
+        return view
+
+    def list_jobs(self) -> list:
+        with self.jobs_lock:
+            return [self.job_view(job, full=False) for job in self.jobs.values()]
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return self.job_view(job) if job else None
+
+
+# =============================================================================
+# HTTP
+# =============================================================================
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "KetryxTemplateService/1.0"
+
+    @property
+    def service(self) -> TemplateService:
+        return self.server.service
+
+    def address_string(self) -> str:
+        # Unix socket peers have no host/port
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}", file=sys.stderr)
+
+    def _send_json(self, status: int, body) -> None:
+        payload = json.dumps(body, indent=2, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._send_json(200, self.service.health())
+        elif path == "/jobs":
+            self._send_json(200, {"jobs": self.service.list_jobs()})
+        elif path.startswith("/jobs/"):
+            job = self.service.get_job(path[len("/jobs/"):])
+            if job:
+                self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "unknown job"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        # Browsers cannot send application/json cross-origin without a preflight
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._send_json(415, {"error": "Content-Type must be application/json"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            spec = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(spec, dict):
+                raise ValueError("job must be a JSON object")
+            job = self.service.submit(spec)
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+        except queue.Full:
+            self._send_json(503, {"error": "job queue is full, retry later"})
+        else:
+            self._send_json(202, self.service.job_view(job, full=False))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service: TemplateService, args: argparse.Namespace) -> socketserver.BaseServer:
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, ServiceRequestHandler)
+        address = f"unix:{args.socket}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ServiceRequestHandler)
+        address = f"http://{args.host}:{args.port}"
+    server.service = service
+    print(f"Serving on {address} ({args.workers} workers, queue size {args.queue_size})")
+    return server
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Ketryx template generation service")
+    parser.add_argument("--syntax", required=True, help="Templating syntax reference JSON")
+    parser.add_argument("--output-dir", required=True, help="Directory for templates, data and work files")
+    parser.add_argument("--data", help="Default project data JSON for jobs")
+    parser.add_argument("--project-id", help="Default Ketryx project to extract data for")
+    parser.add_argument("--version-id", help="Default version ID (default: latest)")
+    parser.add_argument("--api-key", default=os.environ.get("KETRYX_API_KEY"), help="Ketryx API key")
+    parser.add_argument("--base-url", default=os.environ.get("KETRYX_BASE_URL", DEFAULT_BASE_URL), help="Ketryx base URL")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=2, help="Jobs to run at once")
+    parser.add_argument("--queue-size", type=int, default=32, help="Max queued jobs before submissions are rejected")
+    parser.add_argument("--model", default="claude-sonnet-4-5-20250929")
+    parser.add_argument("--fast-model", help="Cheaper model for exploration turns")
+    parser.add_argument("--escalation-model", help="Model to escalate to on validation failure")
+    parser.add_argument("--explore-turns", type=int, default=2)
+    parser.add_argument("--max-iterations", type=int, default=15)
+    parser.add_argument("--cost-limit", type=float, default=10.0)
+    parser.add_argument("--max-stalled-turns", type=int, default=3)
+    parser.add_argument("--stop-on-first-file", action="store_true")
+
+    args = parser.parse_args()
+
+    for p in [args.syntax, args.data]:
+        if p and not Path(p).exists():
+            print(f"Error: not found: {p}", file=sys.stderr)
+            sys.exit(1)
+    if args.project_id and not args.api_key:
+        print("Error: API key required. Use --api-key or set KETRYX_API_KEY", file=sys.stderr)
+        sys.exit(1)
+
+    service = TemplateService(args)
+    service.start()
+    server = make_server(service, args)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,30 @@ Ketryx Template Generation Agent v6 - File-Based Context
 import anthropic
 import argparse
 import base64
+import hashlib
 import json
+import re
+import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict
 
+from ketryx_docx_io import count_template_tags, validate_docx
+
+
+MAX_DOWNLOAD_WORKERS = 8
 
 PRICING = {
     "claude-sonnet-4-5-20250929": {"input": 3.0, "output": 15.0},
     "claude-opus-4-5-20250514": {"input": 15.0, "output": 75.0},
+    "claude-haiku-4-5-20251001": {"input": 1.0, "output": 5.0},
 }
 
+# Suggested --fast-model for exploration turns
+FAST_MODEL = "claude-haiku-4-5-20251001"
+
 
 def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
     p = PRICING.get(model, PRICING["claude-sonnet-4-5-20250929"])
@@ -31,31 +45,9 @@ def upload_file(client: anthropic.Anthropic, file_path: str) -> str:
     return file_obj.id
 
 
-def run_agent(
-    client: anthropic.Anthropic,
-    docx_path: str,
-    data_path: str,
-    syntax_path: str,
-    output_path: str,
-    model: str = "claude-sonnet-4-5-20250929",
-    max_iterations: int = 15,
-    cost_limit: float = 10.0
-):
-    """Run the agent with files in container."""
-    
-    # Upload all files first
-    print("Uploading files...")
-    docx_file_id = upload_file(client, docx_path)
-    print(f"  Uploaded {docx_path} -> {docx_file_id}")
-    
-    data_file_id = upload_file(client, data_path)
-    print(f"  Uploaded {data_path} -> {data_file_id}")
-    
-    syntax_file_id = upload_file(client, syntax_path)
-    print(f"  Uploaded {syntax_path} -> {syntax_file_id}")
-    
-    # System prompt
-    system_prompt = """You are an expert at converting Word documents into Ketryx templates.
+AGENT_BETAS = ["code-execution-2025-08-25", "skills-2025-10-02", "files-api-2025-04-14"]
+
+SYSTEM_PROMPT = """You are an expert at converting Word documents into Ketryx templates.
 
 ## Reference Files in Container
 The following files are available in your working directory:
@@ -85,14 +77,19 @@ Read these files using code execution when you need to look up:
 4. Use KQL + loops for data tables
 5. Save the template, preserving ALL formatting"""
 
-    # First message references uploaded files via container_upload
-    initial_content = [
-        {"type": "container_upload", "file_id": docx_file_id},
-        {"type": "container_upload", "file_id": data_file_id},
-        {"type": "container_upload", "file_id": syntax_file_id},
-        {
-            "type": "text",
-            "text": f"""Convert the attached Word document (input_document.docx) into a Ketryx template.
+
+def build_initial_message(docx_file_id: str, data_file_id: str, syntax_file_id: str, output_path: str,
+                          extra_instructions: str = None) -> dict:
+    """First user turn: container uploads for the three files plus the task."""
+    message = {
+        "role": "user",
+        "content": [
+            {"type": "container_upload", "file_id": docx_file_id},
+            {"type": "container_upload", "file_id": data_file_id},
+            {"type": "container_upload", "file_id": syntax_file_id},
+            {
+                "type": "text",
+                "text": f"""Convert the attached Word document (input_document.docx) into a Ketryx template.
 
 I've included two reference files:
 - ketryx_data.json: Contains all available item types, fields, and relations
@@ -106,57 +103,577 @@ Please:
 5. Save the result to: {output_path}
 
 The output must preserve ALL formatting - only replace text content, not structure."""
-        }
+            }
+        ]
+    }
+    if extra_instructions:
+        message["content"].append({"type": "text", "text": extra_instructions.strip()})
+    return message
+
+
+def build_request_params(model: str, messages: list, container_id: str = None) -> dict:
+    """Messages API parameters for one agent turn (betas are passed separately)."""
+    container_config = {
+        "skills": [{"type": "anthropic", "skill_id": "docx", "version": "latest"}]
+    }
+    if container_id:
+        container_config["id"] = container_id
+    
+    return {
+        "model": model,
+        "max_tokens": 8000,
+        "system": SYSTEM_PROMPT,
+        "container": container_config,
+        "messages": messages,
+        "tools": [{"type": "code_execution_20250825", "name": "code_execution"}],
+    }
+
+
+def scan_response(content: list) -> tuple:
+    """Print text blocks and collect (file_ids, tool_output_hashes, tool_errors) from a turn."""
+    file_ids = []
+    tool_outputs = []
+    tool_errors = []
+    for block in content:
+        if block.type == "text" and block.text.strip():
+            text = block.text[:400] + "..." if len(block.text) > 400 else block.text
+            print(f"\nClaude: {text}")
+        
+        elif block.type == "bash_code_execution_tool_result":
+            result_content = getattr(block, 'content', None)
+            if result_content:
+                stdout = getattr(result_content, 'stdout', '') or ''
+                stderr = getattr(result_content, 'stderr', '') or ''
+                tool_outputs.append(hashlib.sha256((stdout + stderr).encode()).hexdigest())
+                if getattr(result_content, 'return_code', 0) or getattr(result_content, 'error_code', None):
+                    tool_errors.append(stderr.strip() or str(getattr(result_content, 'error_code', '')))
+                
+                inner_content = getattr(result_content, 'content', None) or []
+                for item in inner_content:
+                    if hasattr(item, 'file_id'):
+                        file_ids.append(item.file_id)
+    
+    return file_ids, tool_outputs, tool_errors
+
+
+def serialize_content(content) -> list:
+    """Turn response content blocks into JSON-safe dicts that can be sent back later."""
+    if isinstance(content, str):
+        return content
+    return [
+        block if isinstance(block, dict) else block.to_dict(mode="json", exclude_none=True)
+        for block in content
     ]
+
+
+def _fetch_file(client: anthropic.Anthropic, file_id: str, run_dir: Path) -> dict:
+    """Fetch one container file into run_dir if its metadata says it is a .docx."""
+    result = {"file_id": file_id, "valid": False}
+    try:
+        meta = client.beta.files.retrieve_metadata(
+            file_id=file_id,
+            betas=["files-api-2025-04-14"]
+        )
+        result["filename"] = meta.filename
+        result["created_at"] = str(getattr(meta, "created_at", "") or "")
+        if not meta.filename.lower().endswith(".docx"):
+            result["error"] = "not a .docx"
+            return result
+        
+        file_data = client.beta.files.download(
+            file_id=file_id,
+            betas=["files-api-2025-04-14"]
+        )
+        
+        out_path = run_dir / f"{file_id}_{Path(meta.filename).name}"
+        file_data.write_to_file(str(out_path))
+        
+        result["path"] = str(out_path)
+        result["size"] = out_path.stat().st_size
+        result["sha256"] = hashlib.sha256(out_path.read_bytes()).hexdigest()
+        result["error"] = validate_docx(str(out_path))
+        result["valid"] = result["error"] is None
+        
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def fetch_generated_files(client: anthropic.Anthropic, file_ids: list, run_dir: str) -> list:
+    """Concurrently fetch, hash and validate the .docx files produced in a turn.
+    
+    Returns one result dict per file ID in the original order.
+    """
+    if not file_ids:
+        return []
+    
+    run_path = Path(run_dir)
+    run_path.mkdir(parents=True, exist_ok=True)
+    
+    with ThreadPoolExecutor(max_workers=min(len(file_ids), MAX_DOWNLOAD_WORKERS)) as pool:
+        results = list(pool.map(lambda file_id: _fetch_file(client, file_id, run_path), file_ids))
+    
+    for r in results:
+        print(f"\n> Generated file: {r['file_id']}")
+        if r.get("filename"):
+            print(f"  Name: {r['filename']}")
+        if r.get("path"):
+            print(f"  Saved: {r['path']} ({r['size']:,} bytes, sha256 {r['sha256'][:12]})")
+        if r.get("error"):
+            print(f"  Skipped: {r['error']}")
+    return results
+
+
+def select_newest(results: list, current: dict = None) -> dict:
+    """Pick the newest valid .docx among fetched files, keeping `current` if it is newer.
+    
+    Files from the same turn without timestamps fall back to the order they were produced.
+    """
+    newest = current
+    for r in results:
+        if not r["valid"]:
+            continue
+        if newest is None or r["created_at"] >= newest["created_at"]:
+            newest = r
+    return newest
+
+
+def promote_output(result: dict, output_path: str) -> None:
+    """Copy the chosen run artifact to the final output path."""
+    shutil.copyfile(result["path"], output_path)
+    print(f"  Output: {output_path} <- {Path(result['path']).name}")
+
+
+def make_run_dir(working_dir: str, docx_path: str) -> str:
+    """Per-run directory for intermediate artifacts."""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return str(Path(working_dir) / f"run-{Path(docx_path).stem}-{stamp}")
+
+
+class StallDetector:
+    """Tracks progress signals between agent iterations.
+    
+    An iteration counts as progress if it produced a new file, changed the
+    downloaded output, or ran commands with output not seen before. Failing
+    with the same errors as the previous iteration is never progress.
+    """
+    
+    def __init__(self, max_stalled_turns: int = 3):
+        self.max_stalled_turns = max_stalled_turns
+        self.stalled_turns = 0
+        self.seen_file_ids = set()
+        self.seen_outputs = set()
+        self.last_output_hash = None
+        self.last_errors = []
+    
+    def observe(self, file_ids: list, output_hash: str, tool_outputs: list, tool_errors: list) -> bool:
+        """Record one iteration's signals; returns True if it made progress."""
+        new_files = set(file_ids) - self.seen_file_ids
+        self.seen_file_ids.update(file_ids)
+        
+        output_changed = output_hash is not None and output_hash != self.last_output_hash
+        if output_hash is not None:
+            self.last_output_hash = output_hash
+        
+        new_outputs = set(tool_outputs) - self.seen_outputs
+        self.seen_outputs.update(tool_outputs)
+        
+        repeated_errors = bool(tool_errors) and tool_errors == self.last_errors
+        self.last_errors = tool_errors
+        
+        progressed = bool(new_files or output_changed or (new_outputs and not repeated_errors))
+        self.stalled_turns = 0 if progressed else self.stalled_turns + 1
+        return progressed
+    
+    @property
+    def should_abort(self) -> bool:
+        return self.stalled_turns >= self.max_stalled_turns
+    
+    def to_dict(self) -> dict:
+        return {
+            "stalledTurns": self.stalled_turns,
+            "seenFileIds": sorted(self.seen_file_ids),
+            "seenOutputs": sorted(self.seen_outputs),
+            "lastOutputHash": self.last_output_hash,
+            "lastErrors": self.last_errors,
+        }
+    
+    def load(self, state: dict) -> None:
+        self.stalled_turns = state["stalledTurns"]
+        self.seen_file_ids = set(state["seenFileIds"])
+        self.seen_outputs = set(state["seenOutputs"])
+        self.last_output_hash = state["lastOutputHash"]
+        self.last_errors = state["lastErrors"]
+    
+    def steering_message(self) -> str:
+        """Follow-up prompt for a turn that ended without saving a file."""
+        if self.last_errors:
+            return (
+                "Your last command failed with:\n"
+                f"{self.last_errors[-1][:500]}\n\n"
+                "Try a different approach, then save the template document."
+            )
+        if self.stalled_turns:
+            return "You are not making progress. Save the template document now with what you have."
+        return "Please save the template document now."
+
+
+# Shell commands that write files rather than read them
+EDIT_COMMAND_PATTERN = re.compile(
+    r"sed\s+-i|\.write\(|\.save\(|open\([^)]*['\"][wa]b?\+?['\"]|pack\.py|zip\s+-r|>\s*\S+\.(?:xml|docx)\b"
+)
+EDITOR_WRITE_COMMANDS = {"create", "str_replace", "insert"}
+
+
+def is_edit_turn(content: list) -> bool:
+    """True if a turn's tool calls modify files instead of only reading them."""
+    for block in content:
+        if getattr(block, "type", None) != "server_tool_use":
+            continue
+        tool_input = getattr(block, "input", None) or {}
+        command = str(tool_input.get("command", ""))
+        if getattr(block, "name", "") == "text_editor_code_execution":
+            if command in EDITOR_WRITE_COMMANDS:
+                return True
+        elif EDIT_COMMAND_PATTERN.search(command):
+            return True
+    return False
+
+
+class ModelRouter:
+    """Picks the model for each turn and tracks spend per model.
+    
+    With a fast model, turns start on it while the agent reads the reference
+    files and analyzes the document. The first turn that edits files, or the
+    end of the exploration budget, hands over to the main model for the rest
+    of the run. A failed validation escalates one tier: from the fast model to
+    the main model, or from the main model to the escalation model if set.
+    Without a fast model every turn uses the main model.
+    """
+    
+    def __init__(self, model: str, fast_model: str = None, escalation_model: str = None,
+                 explore_turns: int = 2):
+        self.tiers = {
+            "explore": fast_model if fast_model != model else None,
+            "edit": model,
+            "escalated": escalation_model if escalation_model != model else None,
+        }
+        self.explore_turns = explore_turns
+        self.phase = "explore" if self.tiers["explore"] else "edit"
+        self.explore_turns_used = 0
+        self.spend: Dict[str, float] = {}
+    
+    @property
+    def routing(self) -> bool:
+        return bool(self.tiers["explore"] or self.tiers["escalated"])
     
-    messages = [{"role": "user", "content": initial_content}]
+    def current(self) -> str:
+        return self.tiers[self.phase]
+    
+    def record(self, model: str, usage) -> float:
+        """Add one turn's cost to the per-model spend; returns the turn cost."""
+        cost = estimate_cost(model, usage.input_tokens, usage.output_tokens)
+        self.spend[model] = self.spend.get(model, 0.0) + cost
+        return cost
+    
+    def observe(self, content: list) -> None:
+        """Leave the exploration phase once the agent starts editing or the budget is used."""
+        if self.phase != "explore":
+            return
+        self.explore_turns_used += 1
+        if is_edit_turn(content):
+            self._switch("edit", "editing started")
+        elif self.explore_turns_used >= self.explore_turns:
+            self._switch("edit", "exploration budget used")
+    
+    def escalate(self, reason: str) -> bool:
+        """Move up one tier after a failed validation; False if there is no higher tier."""
+        if self.phase == "explore":
+            self._switch("edit", reason)
+            return True
+        if self.phase == "edit" and self.tiers["escalated"]:
+            self._switch("escalated", reason)
+            return True
+        return False
+    
+    def to_dict(self) -> dict:
+        return {"phase": self.phase, "exploreTurnsUsed": self.explore_turns_used, "spend": self.spend}
+    
+    def load(self, state: dict) -> None:
+        self.phase = state["phase"] if self.tiers.get(state["phase"]) else "edit"
+        self.explore_turns_used = state["exploreTurnsUsed"]
+        self.spend = dict(state["spend"])
+    
+    def _switch(self, phase: str, reason: str) -> None:
+        print(f"  Model: {self.current()} -> {self.tiers[phase]} ({reason})")
+        self.phase = phase
+
+
+# =============================================================================
+# Checkpoints and API retries
+# =============================================================================
+
+API_RETRIES = 5
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def default_checkpoint_path(working_dir: str, docx_path: str) -> str:
+    return str(Path(working_dir) / f"checkpoint-{Path(docx_path).stem}.json")
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    """Write the checkpoint atomically so a crash mid-write keeps the previous one."""
+    checkpoint = Path(path)
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = checkpoint.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    tmp_path.replace(checkpoint)
+
+
+def load_checkpoint(path: str) -> dict:
+    """Saved run state, or None if there is no checkpoint."""
+    if not Path(path).exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _is_dead_container(error: anthropic.APIError) -> bool:
+    return getattr(error, "status_code", None) in (400, 404) and "container" in str(error).lower()
+
+
+def create_with_retry(client: anthropic.Anthropic, params: dict, retries: int = API_RETRIES):
+    """One agent turn, retrying rate limits, overload and connection errors with backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return client.beta.messages.create(betas=AGENT_BETAS, **params)
+        except anthropic.APIError as e:
+            retryable = (isinstance(e, anthropic.APIConnectionError)
+                         or getattr(e, "status_code", None) in RETRYABLE_STATUS)
+            if not retryable or attempt == retries:
+                raise
+            delay = min(2 ** (attempt + 1), 60)
+            print(f"\n  API error: {e}; retrying in {delay}s ({attempt + 1}/{retries})", end="", flush=True)
+            time.sleep(delay)
+
+
+def build_restart_message(client: anthropic.Anthropic, docx_file_id: str, data_file_id: str,
+                          syntax_file_id: str, output_path: str, draft_path: str = None,
+                          extra_instructions: str = None) -> dict:
+    """First turn for a fresh container, carrying over the latest draft if there is one."""
+    message = build_initial_message(docx_file_id, data_file_id, syntax_file_id, output_path, extra_instructions)
+    if draft_path:
+        draft_file_id = upload_file(client, draft_path)
+        message["content"].insert(3, {"type": "container_upload", "file_id": draft_file_id})
+        message["content"].append({
+            "type": "text",
+            "text": f"An earlier session already saved a draft template ({Path(draft_path).name}, "
+                    "also attached). Continue from that draft instead of starting over."
+        })
+    return message
+
+
+def _complete(output_path: str, iteration: int, total_cost: float, spend: Dict[str, float]) -> dict:
+    print(f"\n{'='*60}")
+    print(f"✓ COMPLETE")
+    print(f"  Output: {output_path}")
+    print(f"  Iterations: {iteration}")
+    print(f"  Total cost: ${total_cost:.3f}")
+    if len(spend) > 1:
+        for model, cost in spend.items():
+            print(f"    {model}: ${cost:.3f}")
+    print(f"{'='*60}")
+    return {"success": True, "output_path": output_path, "total_cost": total_cost, "cost_by_model": spend}
+
+
+def _validation_error(fetched: list, selected: dict = None):
+    """Why a turn's saved document is unacceptable, or None.
+    
+    Only the selected document is checked; broken downloads matter only when
+    the turn produced nothing usable.
+    """
+    if selected:
+        if not count_template_tags(selected["path"]):
+            return "the document contains no template tags"
+        return None
+    broken = [r for r in fetched if r.get("path") and not r["valid"]]
+    if broken:
+        return f"{broken[0]['filename']} is not a valid .docx ({broken[0]['error']})"
+    return None
+
+
+def run_agent(
+    client: anthropic.Anthropic,
+    docx_path: str,
+    data_path: str,
+    syntax_path: str,
+    output_path: str,
+    model: str = "claude-sonnet-4-5-20250929",
+    max_iterations: int = 15,
+    cost_limit: float = 10.0,
+    docx_file_id: str = None,
+    data_file_id: str = None,
+    syntax_file_id: str = None,
+    max_stalled_turns: int = 3,
+    stop_on_first_file: bool = False,
+    working_dir: str = "./work",
+    fast_model: str = None,
+    escalation_model: str = None,
+    explore_turns: int = 2,
+    checkpoint_path: str = None,
+    resume: bool = False,
+    extra_instructions: str = None
+):
+    """Run the agent with files in container.
+
+    Files already uploaded by the caller can be passed by ID to skip the
+    upload step for them. The run is aborted after `max_stalled_turns`
+    iterations without progress; with `stop_on_first_file` it ends as soon
+    as a valid .docx has been downloaded.
+
+    Generated files are fetched into a per-run directory under `working_dir`;
+    the newest valid .docx is copied to `output_path`.
+
+    With `fast_model`, exploration turns run on it and `model` takes over for
+    editing; see ModelRouter. A saved document that is not a valid .docx or
+    has no template tags escalates to the next model tier.
+
+    State is checkpointed to `checkpoint_path` (default: under `working_dir`)
+    before every turn. With `resume`, the run continues from the checkpoint
+    in the same container, or in a new one seeded with the latest draft if
+    the container has expired. `max_iterations` and `cost_limit` apply to
+    the whole run, including turns taken before the resume.
+
+    `extra_instructions` are appended to the first user turn.
+    """
+    
+    checkpoint_path = checkpoint_path or default_checkpoint_path(working_dir, docx_path)
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if resume and checkpoint is None:
+        print(f"No checkpoint at {checkpoint_path}, starting a new run")
+    if checkpoint and checkpoint["docxPath"] != str(docx_path):
+        return {"success": False, "error": f"Checkpoint {checkpoint_path} is for {checkpoint['docxPath']}",
+                "total_cost": 0.0}
+    
+    router = ModelRouter(model, fast_model, escalation_model, explore_turns)
+    stall_detector = StallDetector(max_stalled_turns)
+    
+    if checkpoint:
+        docx_file_id, data_file_id, syntax_file_id = (
+            checkpoint["fileIds"][k] for k in ("docx", "data", "syntax")
+        )
+        messages = checkpoint["messages"]
+        run_dir = checkpoint["runDir"]
+        container_id = checkpoint["containerId"]
+        iteration = checkpoint["iteration"]
+        total_cost = checkpoint["totalCost"]
+        current_output = checkpoint["currentOutput"]
+        router.load(checkpoint["router"])
+        stall_detector.load(checkpoint["stallDetector"])
+    else:
+        # Upload any files the caller has not uploaded yet
+        print("Uploading files...")
+        if not docx_file_id:
+            docx_file_id = upload_file(client, docx_path)
+            print(f"  Uploaded {docx_path} -> {docx_file_id}")
+        
+        if not data_file_id:
+            data_file_id = upload_file(client, data_path)
+            print(f"  Uploaded {data_path} -> {data_file_id}")
+        
+        if not syntax_file_id:
+            syntax_file_id = upload_file(client, syntax_path)
+            print(f"  Uploaded {syntax_path} -> {syntax_file_id}")
+        
+        messages = [build_initial_message(docx_file_id, data_file_id, syntax_file_id, output_path,
+                                          extra_instructions)]
+        run_dir = make_run_dir(working_dir, docx_path)
+        container_id = None
+        iteration = 0
+        total_cost = 0.0
+        current_output = None
+    
+    def save(status: str = "running") -> None:
+        save_checkpoint(checkpoint_path, {
+            "status": status,
+            "docxPath": str(docx_path),
+            "outputPath": output_path,
+            "fileIds": {"docx": docx_file_id, "data": data_file_id, "syntax": syntax_file_id},
+            "runDir": run_dir,
+            "containerId": container_id,
+            "iteration": iteration,
+            "totalCost": total_cost,
+            "currentOutput": current_output,
+            "router": router.to_dict(),
+            "stallDetector": stall_detector.to_dict(),
+            "messages": messages,
+        })
+    
+    def fail(error: str, status: str = "failed") -> dict:
+        save(status)
+        return {"success": False, "error": error, "total_cost": total_cost,
+                "cost_by_model": router.spend, "checkpoint": checkpoint_path}
+    
+    def complete() -> dict:
+        save("done")
+        return _complete(output_path, iteration, total_cost, router.spend)
     
     print("\n" + "="*60)
     print("KETRYX TEMPLATE AGENT v6 (File-Based Context)")
     print("="*60)
-    print(f"Model: {model}")
+    if router.routing:
+        tiers = " -> ".join(m for m in router.tiers.values() if m)
+        print(f"Models: {tiers}")
+    else:
+        print(f"Model: {model}")
     print(f"Cost limit: ${cost_limit:.2f}")
     print(f"Document: {docx_path}")
+    print(f"Run directory: {run_dir}")
+    print(f"Checkpoint: {checkpoint_path}")
+    if checkpoint:
+        print(f"Resuming after iteration {iteration} (${total_cost:.3f} spent, container {container_id})")
     print("="*60)
     
-    total_cost = 0.0
-    container_id = None
-    iteration = 0
+    if checkpoint and checkpoint["status"] == "done":
+        print("\nCheckpoint is already complete")
+        return _complete(output_path, iteration, total_cost, router.spend)
     
     while iteration < max_iterations:
-        iteration += 1
-        print(f"\n--- Iteration {iteration} ---")
-        
+        save()
         if total_cost >= cost_limit:
             print(f"\n⚠️ Cost limit reached: ${total_cost:.2f}")
-            return {"success": False, "error": "Cost limit reached", "total_cost": total_cost}
+            return fail("Cost limit reached", "stopped")
         
-        container_config = {
-            "skills": [{"type": "anthropic", "skill_id": "docx", "version": "latest"}]
-        }
-        if container_id:
-            container_config["id"] = container_id
+        iteration += 1
+        print(f"\n--- Iteration {iteration} ---")
         
+        turn_model = router.current()
+        if router.routing:
+            print(f"Model: {turn_model}")
         print("Processing...", end="", flush=True)
         
         try:
-            response = client.beta.messages.create(
-                model=model,
-                max_tokens=8000,
-                betas=["code-execution-2025-08-25", "skills-2025-10-02", "files-api-2025-04-14"],
-                system=system_prompt,
-                container=container_config,
-                messages=messages,
-                tools=[{"type": "code_execution_20250825", "name": "code_execution"}]
-            )
+            response = create_with_retry(client, build_request_params(turn_model, messages, container_id))
         except anthropic.APIError as e:
+            iteration -= 1
+            if container_id and _is_dead_container(e):
+                # Files edited in the old container are gone; restart from the latest draft
+                print(f"\nContainer {container_id} is no longer available, continuing in a new one")
+                container_id = None
+                messages = [build_restart_message(
+                    client, docx_file_id, data_file_id, syntax_file_id, output_path,
+                    current_output["path"] if current_output else None,
+                    extra_instructions
+                )]
+                continue
             print(f"\nAPI Error: {e}")
-            return {"success": False, "error": str(e), "total_cost": total_cost}
+            return fail(str(e))
         
         print(" done.")
         
         usage = response.usage
-        iter_cost = estimate_cost(model, usage.input_tokens, usage.output_tokens)
+        iter_cost = router.record(turn_model, usage)
         total_cost += iter_cost
         
         print(f"  Tokens: {usage.input_tokens:,} in / {usage.output_tokens:,} out")
@@ -165,105 +682,189 @@ The output must preserve ALL formatting - only replace text content, not structu
         if hasattr(response, 'container') and response.container:
             container_id = response.container.id
         
-        has_file = False
-        for block in response.content:
-            if block.type == "text" and block.text.strip():
-                text = block.text[:400] + "..." if len(block.text) > 400 else block.text
-                print(f"\nClaude: {text}")
-            
-            elif block.type == "bash_code_execution_tool_result":
-                result_content = getattr(block, 'content', None)
-                if result_content:
-                    inner_content = getattr(result_content, 'content', [])
-                    for item in inner_content:
-                        if hasattr(item, 'file_id'):
-                            has_file = True
-                            file_id = item.file_id
-                            print(f"\n> Generated file: {file_id}")
-                            
-                            try:
-                                meta = client.beta.files.retrieve_metadata(
-                                    file_id=file_id,
-                                    betas=["files-api-2025-04-14"]
-                                )
-                                print(f"  Name: {meta.filename}")
-                                
-                                file_data = client.beta.files.download(
-                                    file_id=file_id,
-                                    betas=["files-api-2025-04-14"]
-                                )
-                                
-                                out_path = Path(output_path)
-                                file_data.write_to_file(str(out_path))
-                                print(f"  Saved: {out_path} ({out_path.stat().st_size:,} bytes)")
-                                
-                            except Exception as e:
-                                print(f"  Error: {e}")
+        file_ids, tool_outputs, tool_errors = scan_response(response.content)
+        assistant_turn = {"role": "assistant", "content": serialize_content(response.content)}
+        
+        fetched = fetch_generated_files(client, file_ids, run_dir)
+        newest = select_newest(fetched, current_output)
+        has_file = newest is not current_output
+        
+        # A rejected document stays in the run directory and is not progress
+        validation_error = _validation_error(fetched, newest if has_file else None)
+        rejected = has_file and validation_error is not None
+        if rejected:
+            has_file = False
+            file_ids = [f for f in file_ids if f != newest["file_id"]]
+        elif has_file:
+            promote_output(newest, output_path)
+            current_output = newest
+        
+        output_hash = current_output["sha256"] if current_output else None
+        stall_detector.observe(file_ids, output_hash, tool_outputs, tool_errors)
+        
+        if stall_detector.should_abort:
+            print(f"\nNo progress in {stall_detector.stalled_turns} iterations, stopping early")
+            return fail("Stalled")
+        
+        # Validation failures go to a stronger model when there is one
+        if validation_error and (router.escalate(validation_error) or rejected):
+            messages.append(assistant_turn)
+            messages.append({
+                "role": "user",
+                "content": f"The saved document failed validation: {validation_error}. "
+                           "Fix it and save the template document again."
+            })
+            continue
+        router.observe(response.content)
+        
+        if stop_on_first_file and has_file:
+            return complete()
         
         if response.stop_reason == "end_turn":
             if has_file:
-                print(f"\n{'='*60}")
-                print(f"✓ COMPLETE")
-                print(f"  Output: {output_path}")
-                print(f"  Iterations: {iteration}")
-                print(f"  Total cost: ${total_cost:.3f}")
-                print(f"{'='*60}")
-                return {"success": True, "output_path": output_path, "total_cost": total_cost}
+                return complete()
             else:
                 print("\nNo file output, may need to continue...")
-                messages.append({"role": "assistant", "content": response.content})
+                messages.append(assistant_turn)
                 messages.append({
                     "role": "user", 
-                    "content": "Please save the template document now."
+                    "content": stall_detector.steering_message()
                 })
                 continue
         
         elif response.stop_reason == "pause_turn":
             print("  (Continuing long operation...)")
-            messages.append({"role": "assistant", "content": response.content})
+            messages.append(assistant_turn)
             continue
         
         else:
-            messages.append({"role": "assistant", "content": response.content})
+            messages.append(assistant_turn)
     
     print(f"\nStopped after {iteration} iterations")
-    return {"success": False, "error": "Max iterations", "total_cost": total_cost}
+    return fail("Max iterations", "stopped")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Ketryx Template Generator v6")
-    parser.add_argument("--docx", required=True)
+    parser.add_argument("--docx", required=True, nargs="+",
+                        help="Input Word document (several with --batch)")
     parser.add_argument("--data", required=True)
     parser.add_argument("--syntax", required=True)
-    parser.add_argument("--output", required=True)
-    parser.add_argument("--model", default="claude-sonnet-4-5-20250929")
+    parser.add_argument("--output", required=True,
+                        help="Output template path (output directory with --batch)")
+    parser.add_argument("--working-dir", default="./work",
+                        help="Directory for per-run intermediate files")
+    parser.add_argument("--model", default="claude-sonnet-4-5-20250929",
+                        help="Model for editing turns (and every turn without --fast-model)")
+    parser.add_argument("--fast-model",
+                        help=f"Cheaper model for exploration turns, e.g. {FAST_MODEL}")
+    parser.add_argument("--escalation-model",
+                        help="Model to switch to if --model saves a document that fails validation")
+    parser.add_argument("--explore-turns", type=int, default=2,
+                        help="Max turns on --fast-model before editing starts")
     parser.add_argument("--max-iterations", type=int, default=15)
     parser.add_argument("--cost-limit", type=float, default=10.0)
+    parser.add_argument("--max-stalled-turns", type=int, default=3,
+                        help="Abort after this many iterations without progress")
+    parser.add_argument("--stop-on-first-file", action="store_true",
+                        help="Stop as soon as a valid .docx has been downloaded")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the last checkpoint of an interrupted run")
+    parser.add_argument("--checkpoint",
+                        help="Checkpoint file (default: <working-dir>/checkpoint-<docx stem>.json)")
+    parser.add_argument("--sections", action="store_true",
+                        help="Split a large document into sections templated by concurrent sessions")
+    parser.add_argument("--max-section-kb", type=int, default=200,
+                        help="Target maximum body XML per section with --sections")
+    parser.add_argument("--section-concurrency", type=int, default=4,
+                        help="Section sessions to run at once with --sections")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all documents through the Message Batches API")
+    parser.add_argument("--batch-state",
+                        help="Batch state file for resuming (default: <output>/batch_state.json)")
+    parser.add_argument("--poll-interval", type=float, default=60.0,
+                        help="Seconds between batch status checks")
     
     args = parser.parse_args()
     
-    for p, n in [(args.docx, "docx"), (args.data, "data"), (args.syntax, "syntax")]:
+    if len(args.docx) > 1 and not args.batch:
+        print("Error: multiple --docx inputs require --batch")
+        sys.exit(1)
+    
+    if args.sections and args.batch:
+        print("Error: --sections cannot be combined with --batch")
+        sys.exit(1)
+    
+    for p, n in [*[(d, "docx") for d in args.docx], (args.data, "data"), (args.syntax, "syntax")]:
         if not Path(p).exists():
             print(f"Error: {n} not found: {p}")
             sys.exit(1)
     
     client = anthropic.Anthropic()
     
-    result = run_agent(
-        client=client,
-        docx_path=args.docx,
-        data_path=args.data,
-        syntax_path=args.syntax,
-        output_path=args.output,
-        model=args.model,
-        max_iterations=args.max_iterations,
-        cost_limit=args.cost_limit
-    )
+    if args.batch:
+        from ketryx_batch import run_batch
+        result = run_batch(
+            client=client,
+            docx_paths=args.docx,
+            data_path=args.data,
+            syntax_path=args.syntax,
+            output_dir=args.output,
+            state_path=args.batch_state,
+            model=args.model,
+            max_iterations=args.max_iterations,
+            cost_limit=args.cost_limit,
+            poll_interval=args.poll_interval
+        )
+    elif args.sections:
+        from ketryx_sections import run_sectioned
+        result = run_sectioned(
+            client=client,
+            docx_path=args.docx[0],
+            data_path=args.data,
+            syntax_path=args.syntax,
+            output_path=args.output,
+            working_dir=args.working_dir,
+            max_section_bytes=args.max_section_kb * 1024,
+            concurrency=args.section_concurrency,
+            model=args.model,
+            max_iterations=args.max_iterations,
+            cost_limit=args.cost_limit,
+            max_stalled_turns=args.max_stalled_turns,
+            stop_on_first_file=args.stop_on_first_file,
+            fast_model=args.fast_model,
+            escalation_model=args.escalation_model,
+            explore_turns=args.explore_turns,
+            resume=args.resume
+        )
+    else:
+        result = run_agent(
+            client=client,
+            docx_path=args.docx[0],
+            data_path=args.data,
+            syntax_path=args.syntax,
+            output_path=args.output,
+            model=args.model,
+            max_iterations=args.max_iterations,
+            cost_limit=args.cost_limit,
+            max_stalled_turns=args.max_stalled_turns,
+            stop_on_first_file=args.stop_on_first_file,
+            working_dir=args.working_dir,
+            fast_model=args.fast_model,
+            escalation_model=args.escalation_model,
+            explore_turns=args.explore_turns,
+            checkpoint_path=args.checkpoint,
+            resume=args.resume
+        )
     
     print(f"\nFinal cost: ${result.get('total_cost', 0):.3f}")
+    for model, cost in result.get("cost_by_model", {}).items():
+        print(f"  {model}: ${cost:.3f}")
     
     if not result.get("success"):
         print(f"Failed: {result.get('error')}")
+        if result.get("checkpoint"):
+            print(f"Re-run with --resume to continue from {result['checkpoint']}")
         sys.exit(1)
 
 